@@ -0,0 +1,106 @@
+"""Incremental log-mel features against whisper's batch computation.
+
+Replays what a streaming session does with partials enabled: a segment grows
+to `--segment-s` seconds, is re-decoded every `--interval-ms`, and from time
+to time its transcribed prefix is cut off (`--commit-every` partials). For
+every window it builds the model input twice, with
+whisper.log_mel_spectrogram(pad_or_trim(window)) and with IncrementalLogMel,
+and reports:
+
+- the largest absolute difference between the two (must be below `--tolerance`)
+- total feature time per segment for both, and the speedup
+
+Results are written as JSON (with the git commit) so runs can be compared.
+
+    python benchmarks/log_mel.py --n-mels 128 --segments 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import whisper  # noqa: E402
+from mel_features import IncrementalLogMel  # noqa: E402
+from stream_load import SAMPLE_RATE, git_commit, load_fixture, synthetic_fixture  # noqa: E402
+
+COMMIT_STEP_S = 0.02  # Cuts fall on Whisper timestamps
+
+
+def windows(audio, interval, commit_every, rng):
+    """Yields (window, start) as a session would: growing partials, prefix cuts, then the final."""
+    start = 0
+    for n, end in enumerate(range(interval, len(audio) + 1, interval), 1):
+        yield audio[start:end], start
+        if commit_every and n % commit_every == 0:
+            cut = round(rng.uniform(0.2, 0.8) * (end - start) / SAMPLE_RATE / COMMIT_STEP_S) * COMMIT_STEP_S
+            start += round(cut * SAMPLE_RATE)
+    yield audio[start:], start
+
+
+def run(segments, n_mels, interval, commit_every, seed):
+    rng = np.random.default_rng(seed)
+    extractor = IncrementalLogMel(n_mels)
+    worst = 0.0
+    batch_seconds = incremental_seconds = 0.0
+    count = 0
+    for audio in segments:
+        extractor.reset()
+        for window, start in windows(audio, interval, commit_every, rng):
+            started = time.perf_counter()
+            expected = whisper.log_mel_spectrogram(whisper.pad_or_trim(window), n_mels=n_mels)
+            batch_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            actual = extractor.features(window, start)
+            incremental_seconds += time.perf_counter() - started
+            worst = max(worst, float((expected - actual).abs().max()))
+            count += 1
+    return {"windows": count, "max_abs_diff": worst,
+            "batch_ms_per_segment": 1000 * batch_seconds / len(segments),
+            "incremental_ms_per_segment": 1000 * incremental_seconds / len(segments),
+            "speedup": batch_seconds / incremental_seconds if incremental_seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="*", help="WAV files cut into segments; synthetic audio if none")
+    parser.add_argument("--segments", type=int, default=10)
+    parser.add_argument("--segment-s", type=float, default=15, help="Segment length, VAD_MAX_SEGMENT_S")
+    parser.add_argument("--interval-ms", type=int, default=500, help="Partial interval, PARTIAL_INTERVAL_MS")
+    parser.add_argument("--commit-every", type=int, default=4, help="Partials between prefix cuts, 0 for none")
+    parser.add_argument("--n-mels", type=int, default=80, choices=(80, 128))
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads, as on the server's event loop")
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    parser.add_argument("--output", default="log_mel_results.json")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    length = int(args.segment_s * SAMPLE_RATE)
+    if args.fixtures:
+        audio = np.concatenate([load_fixture(path) for path in args.fixtures])
+    else:
+        audio = synthetic_fixture(args.segments * args.segment_s, seed=0)
+    audio = audio.astype(np.float32) / 32768
+    segments = [audio[i:i + length] for i in range(0, len(audio) - length + 1, length)][:args.segments]
+    if not segments:
+        raise SystemExit(f"Need at least {args.segment_s}s of audio")
+
+    result = run(segments, args.n_mels, SAMPLE_RATE * args.interval_ms // 1000, args.commit_every, seed=0)
+    results = {"commit": git_commit(), "config": vars(args), **result}
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"{result['windows']} windows over {len(segments)} segments, commit {results['commit']}")
+    print(f"  {'max abs difference':<28}{result['max_abs_diff']:.2e} (tolerance {args.tolerance:.0e})")
+    print(f"  {'batch ms / segment':<28}{result['batch_ms_per_segment']:.1f}")
+    print(f"  {'incremental ms / segment':<28}{result['incremental_ms_per_segment']:.1f}")
+    print(f"  {'speedup':<28}{result['speedup']:.2f}x")
+    print(f"Results written to {args.output}")
+    if result["max_abs_diff"] > args.tolerance:
+        sys.exit("Incremental features do not match the batch computation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Accuracy and latency of int8 CPU inference against the fp32 baseline.
+
+Loads the model once per precision, each in a fresh process so peak memory is
+measured per mode, and transcribes every fixture with the same call the
+upload server uses. Reports, per precision:
+
+- latency per fixture (median over `--repeats` runs) and real-time factor
+- model size (serialized weights) and peak resident memory of the process
+- transcript agreement with fp32: 1 - word error rate, with fp32 as reference
+
+Results are written as JSON (with the git commit) so runs can be compared.
+
+    python benchmarks/quantization.py --model small --threads 4 fixtures/*.wav
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from stream_load import SAMPLE_RATE, git_commit, load_fixture  # noqa: E402
+
+PRECISIONS = ("fp32", "int8")
+
+
+def word_errors(reference, hypothesis):
+    """Word-level Levenshtein distance between two transcripts."""
+    ref, hyp = reference.lower().split(), hypothesis.lower().split()
+    row = list(range(len(hyp) + 1))
+    for i, word in enumerate(ref, 1):
+        previous, row[0] = row[0], i
+        for j, other in enumerate(hyp, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (word != other))
+    return row[-1], len(ref)
+
+
+def run_mode(precision, model_name, threads, fixtures, repeats, language, task):
+    """Runs in a child process: loads the model at `precision` and transcribes each fixture."""
+    import torch
+    from inference import load_model, transcribe_long
+
+    started = time.perf_counter()
+    model = load_model(model_name, device="cpu", precision=precision, threads=threads)
+    load_seconds = time.perf_counter() - started
+    weights = io.BytesIO()
+    torch.save(model.state_dict(), weights)
+
+    transcribe_long(model, np.zeros(SAMPLE_RATE, dtype=np.float32), language, task)  # Warm-up
+    results = []
+    for path in fixtures:
+        audio = load_fixture(path).astype(np.float32) / 32768
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            text = transcribe_long(model, audio, language, task)
+            timings.append(time.perf_counter() - started)
+        latency = float(np.median(timings))
+        results.append({"fixture": path, "seconds": len(audio) / SAMPLE_RATE, "latency": latency,
+                        "rtf": latency / (len(audio) / SAMPLE_RATE), "text": text.strip()})
+
+    return {
+        "precision": precision,
+        "load_seconds": load_seconds,
+        "model_mb": weights.tell() / 2**20,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KiB on Linux
+        "fixtures": results,
+    }
+
+
+def compare(modes):
+    """Adds agreement with the fp32 transcripts to every other mode."""
+    reference = {item["fixture"]: item["text"] for item in modes["fp32"]["fixtures"]}
+    for mode in modes.values():
+        errors = words = 0
+        for item in mode["fixtures"]:
+            item_errors, item_words = word_errors(reference[item["fixture"]], item["text"])
+            item["agreement"] = 1 - item_errors / max(1, item_words)
+            errors += item_errors
+            words += item_words
+        mode["agreement"] = 1 - errors / max(1, words)
+        mode["mean_latency"] = float(np.mean([item["latency"] for item in mode["fixtures"]]))
+        mode["rtf"] = (sum(item["latency"] for item in mode["fixtures"]) /
+                       sum(item["seconds"] for item in mode["fixtures"]))
+
+
+def print_report(results):
+    print(f"Model {results['model']}, {results['threads'] or 'default'} threads, commit {results['commit']}")
+    baseline = results["modes"]["fp32"]
+    print(f"  {'precision':<10}{'latency s':>11}{'RTF':>8}{'speedup':>9}{'model MB':>10}{'peak MB':>9}{'agreement':>11}")
+    for precision, mode in results["modes"].items():
+        speedup = baseline["mean_latency"] / mode["mean_latency"]
+        print(f"  {precision:<10}{mode['mean_latency']:11.3f}{mode['rtf']:8.3f}{speedup:9.2f}"
+              f"{mode['model_mb']:10.1f}{mode['peak_rss_mb']:9.0f}{mode['agreement']:11.3f}")
+    for item in results["modes"]["int8"]["fixtures"]:
+        if item["agreement"] < 1:
+            print(f"  {os.path.basename(item['fixture'])}: int8 agreement {item['agreement']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="+", help="WAV files with speech")
+    parser.add_argument("--model", default="small", help="Whisper model size")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads (default: all cores)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per fixture; the median is reported")
+    parser.add_argument("--language", default="de")
+    parser.add_argument("--task", default="translate")
+    parser.add_argument("--output", default="quantization_results.json")
+    args = parser.parse_args()
+
+    # One fresh process per precision so memory figures do not include the other model
+    context = multiprocessing.get_context("spawn")
+    modes = {}
+    for precision in PRECISIONS:
+        with context.Pool(1) as pool:
+            modes[precision] = pool.apply(run_mode, (precision, args.model, args.threads, args.fixtures,
+                                                     args.repeats, args.language, args.task))
+    compare(modes)
+
+    results = {"model": args.model, "threads": args.threads, "repeats": args.repeats,
+               "commit": git_commit(), "modes": modes}
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
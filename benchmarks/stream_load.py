@@ -0,0 +1,269 @@
+"""Load and latency benchmark for whisper_server_stream.py.
+
+Replays WAV fixtures as N concurrent streaming clients, each the same
+StreamClient the app uses: audio is written into a bounded capture ring at
+real-time pace (or `--speed` times faster), gated by the same VAD, and sent
+in `--chunk-ms` frames. Reports, over all clients:
+
+- time to transcript: from sending the end of an utterance to receiving its
+  final text (p50/p95/p99), and the same for partials when enabled
+- real-time factor: wall time from first audio sent to last transcript
+  received, divided by the audio duration of that client
+- throughput: seconds of audio transcribed per wall-clock second
+- dropped audio: audio the capture ring discarded because sending stalled
+- upload bandwidth: kbit sent per second of audio, to compare `--codec` choices
+- skipped audio and catch-up episodes: what the server gave up to stay near real time
+
+Results are written as JSON (with the git commit) so runs can be compared.
+
+Offline run against a small CPU model and the fake translator:
+    python benchmarks/stream_load.py --spawn-server --model tiny --clients 10 fixtures/*.wav
+Compare with an earlier run:
+    python benchmarks/stream_load.py --clients 10 --baseline old.json fixtures/*.wav
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+from audio_buffer import CaptureRingBuffer  # noqa: E402
+from stream_client import SAMPLE_RATE, StreamClient, load_wav, play  # noqa: E402
+
+load_fixture = load_wav  # Reads a PCM WAV file as 16 kHz mono int16 samples
+
+
+def synthetic_fixture(seconds, seed):
+    """Tone bursts separated by pauses over a low noise floor, for runs without real speech."""
+    rng = np.random.default_rng(seed)
+    pieces = []
+    total = 0
+    while total < seconds * SAMPLE_RATE:
+        burst = int(rng.uniform(1.0, 4.0) * SAMPLE_RATE)
+        t = np.arange(burst) / SAMPLE_RATE
+        pieces.append(0.3 * np.sin(2 * np.pi * rng.uniform(120, 300) * t))
+        pieces.append(np.zeros(int(rng.uniform(0.6, 1.5) * SAMPLE_RATE)))
+        total += len(pieces[-2]) + len(pieces[-1])
+    audio = np.concatenate(pieces) + rng.normal(0, 0.002, total)
+    return (audio * 32767).astype(np.int16)
+
+
+class ClientStats:
+    def __init__(self, audio_seconds):
+        self.audio_seconds = audio_seconds
+        self.final_latencies = []
+        self.partial_latencies = []
+        self.dropped_samples = 0
+        self.skipped_seconds = 0.0  # Audio the server skipped to catch up
+        self.catchups = 0
+        self.sent_bytes = 0
+        self.start = None
+        self.last_transcript = None
+        self.error = None
+
+
+class SendLog:
+    """Maps stream positions (samples sent) to the wall time they were sent at."""
+
+    def __init__(self):
+        self.positions = []
+        self.times = []
+
+    def record(self, position, sent_at):
+        self.positions.append(position)
+        self.times.append(sent_at)
+
+    def sent_at(self, position):
+        index = bisect.bisect_left(self.positions, position)
+        return self.times[min(index, len(self.times) - 1)] if self.times else None
+
+
+def receive(response, send_log, stats):
+    received_at = time.perf_counter()
+    if response.get("type") == "config":
+        stats.start = received_at  # The session is accepted, audio starts
+    elif response.get("type") == "skipped":
+        stats.skipped_seconds += response["audio_end"] - response["audio_start"]
+    elif response.get("type") == "status" and response.get("mode") == "catchup":
+        stats.catchups += 1
+    if response.get("type") not in ("partial", "final"):
+        return  # Config echo, detected language, status
+    sent_at = send_log.sent_at(int(response.get("audio_end", 0) * SAMPLE_RATE))
+    if sent_at is None:
+        return
+    if response.get("type") == "partial":
+        stats.partial_latencies.append(received_at - sent_at)
+    else:
+        stats.final_latencies.append(received_at - sent_at)
+    stats.last_transcript = received_at
+
+
+def sent(message, position, send_log, stats):
+    stats.sent_bytes += len(message)
+    send_log.record(position, time.perf_counter())
+
+
+async def run_client(uri, audio, args, stats, start_delay):
+    await asyncio.sleep(start_delay)
+    send_log = SendLog()
+    client = StreamClient(uri, CaptureRingBuffer(int(SAMPLE_RATE * args.buffer_s)), SAMPLE_RATE * args.chunk_ms // 1000,
+                          language=args.language, codecs=[args.codec], drain_timeout=args.drain_timeout,
+                          on_message=lambda response: receive(response, send_log, stats),
+                          on_send=lambda message, position: sent(message, position, send_log, stats))
+    player = asyncio.ensure_future(play(client, audio, args.speed))
+    try:
+        await client.run()
+    except Exception as e:
+        stats.error = str(e)
+    finally:
+        player.cancel()
+    stats.dropped_samples = client.capture.dropped
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values)
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=SRC_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def spawn_server(args):
+    """Starts whisper_server_stream.py with a small CPU model and the fake translator."""
+    env = dict(os.environ, WHISPER_MODEL=args.model, WHISPER_PRECISION=args.precision,
+               TRANSLATOR_BACKEND="fake", PORT=str(args.port))
+    if args.cpu:
+        env["CUDA_VISIBLE_DEVICES"] = ""
+    process = subprocess.Popen([sys.executable, "whisper_server_stream.py"], cwd=SRC_DIR, env=env,
+                               stdout=subprocess.DEVNULL if args.quiet_server else None)
+    deadline = time.monotonic() + args.server_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", args.port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Server did not start in time")
+
+
+async def run(args, fixtures):
+    uri = args.uri or f"ws://127.0.0.1:{args.port}"
+    clients = []
+    for i in range(args.clients):
+        audio = fixtures[i % len(fixtures)]
+        stats = ClientStats(len(audio) / SAMPLE_RATE)
+        clients.append(stats)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(uri, fixtures[i % len(fixtures)], args, stats, i * args.ramp_s)
+        for i, stats in enumerate(clients)
+    ))
+
+    finished = [c for c in clients if c.start is not None and c.last_transcript is not None]
+    end = max((c.last_transcript for c in finished), default=time.perf_counter())
+    audio_seconds = sum(c.audio_seconds for c in finished)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "baseline"},
+        "clients": args.clients,
+        "errors": [c.error for c in clients if c.error],
+        "time_to_transcript_s": summarize([l for c in clients for l in c.final_latencies]),
+        "time_to_partial_s": summarize([l for c in clients for l in c.partial_latencies]),
+        "real_time_factor": summarize([(c.last_transcript - c.start) / c.audio_seconds for c in finished]),
+        "throughput_audio_s_per_s": audio_seconds / (end - start) if end > start else 0.0,
+        "dropped_audio_s": sum(c.dropped_samples for c in clients) / SAMPLE_RATE,
+        "skipped_audio_s": sum(c.skipped_seconds for c in clients),
+        "catchups": sum(c.catchups for c in clients),
+        "upload_kbit_per_audio_s": (8 * sum(c.sent_bytes for c in clients) / 1000 / audio_seconds
+                                    if audio_seconds else 0.0),
+    }
+
+
+def print_report(results, baseline=None):
+    def line(name, value, old):
+        delta = f"  ({value - old:+.3f})" if old is not None else ""
+        print(f"  {name:<34}{value:10.3f}{delta}")
+
+    print(f"{results['clients']} clients, commit {results['commit']}")
+    for metric in ("time_to_transcript_s", "time_to_partial_s", "real_time_factor"):
+        for stat in ("p50", "p95", "p99"):
+            if stat in results[metric]:
+                old = baseline.get(metric, {}).get(stat) if baseline else None
+                line(f"{metric} {stat}", results[metric][stat], old)
+    for metric in ("throughput_audio_s_per_s", "dropped_audio_s", "skipped_audio_s", "catchups",
+                   "upload_kbit_per_audio_s"):
+        if metric in results:
+            line(metric, results[metric], baseline.get(metric) if baseline else None)
+    for error in results["errors"]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="*", help="16-bit WAV files to replay")
+    parser.add_argument("--synthetic", type=float, default=30, help="Seconds of synthetic audio when no fixtures are given")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--speed", type=float, default=1.0, help="Pacing relative to real time, 0 sends as fast as possible")
+    parser.add_argument("--ramp-s", type=float, default=0.25, help="Delay between client starts")
+    parser.add_argument("--chunk-ms", type=int, default=250)
+    parser.add_argument("--codec", default="pcm16", help="Audio codec offered to the server (pcm16, mulaw, alaw)")
+    parser.add_argument("--language", default="de", help="Source language sent in the session config, or auto")
+    parser.add_argument("--buffer-s", type=float, default=10, help="Client capture ring size")
+    parser.add_argument("--drain-timeout", type=float, default=15, help="Quiet time that ends a session")
+    parser.add_argument("--uri", help="Server to test, defaults to ws://127.0.0.1:PORT")
+    parser.add_argument("--port", type=int, default=42331)
+    parser.add_argument("--spawn-server", action="store_true", help="Start a local server for the run")
+    parser.add_argument("--model", default="tiny", help="Whisper model of the spawned server")
+    parser.add_argument("--cpu", action="store_true", help="Hide GPUs from the spawned server")
+    parser.add_argument("--precision", default="fp32", choices=("fp32", "int8"), help="Inference precision of the spawned server")
+    parser.add_argument("--server-timeout", type=float, default=300)
+    parser.add_argument("--quiet-server", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    fixtures = [load_fixture(path) for path in args.fixtures] or [synthetic_fixture(args.synthetic, seed=0)]
+    server = spawn_server(args) if args.spawn_server else None
+    try:
+        results = asyncio.run(run(args, fixtures))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import numpy as np
+
+INT16_SCALE = np.float32(1 / 32768)
+
+
+class AudioRingBuffer:
+    """Preallocated int16 ring buffer for mono PCM audio.
+
+    Incoming frames are written straight into a fixed int16 array, and reads
+    convert the requested samples into a preallocated float32 array, so the
+    steady state allocates nothing and never touches the disk.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity  # Capacity in samples
+        self._samples = np.zeros(capacity, dtype=np.int16)
+        self._float = np.zeros(capacity, dtype=np.float32)
+        self._start = 0  # Index of the oldest sample
+        self._size = 0  # Number of samples currently stored
+        self._pending = b""  # Odd trailing byte of a frame split mid-sample
+        self.dropped = 0  # Samples overwritten because the buffer was full
+
+    def __len__(self):
+        return self._size
+
+    def write(self, data):
+        """Appends 16-bit PCM bytes (or an int16 array), overwriting the oldest samples when full."""
+        if isinstance(data, np.ndarray):
+            samples = data.astype(np.int16, copy=False).reshape(-1)
+        else:
+            if self._pending:
+                data = self._pending + bytes(data)
+                self._pending = b""
+            if len(data) % 2:
+                self._pending = bytes(data[-1:])
+                data = data[:-1]
+            samples = np.frombuffer(data, dtype=np.int16)
+
+        n = len(samples)
+        if n > self.capacity:
+            # Only the newest `capacity` samples can survive
+            self.dropped += n - self.capacity
+            self.discard(self._size)
+            samples = samples[-self.capacity:]
+            n = self.capacity
+
+        overflow = self._size + n - self.capacity
+        if overflow > 0:
+            self.dropped += overflow
+            self.discard(overflow)
+
+        end = (self._start + self._size) % self.capacity
+        first = min(n, self.capacity - end)
+        self._samples[end:end + first] = samples[:first]
+        self._samples[:n - first] = samples[first:]
+        self._size += n
+
+    def read(self, n=None):
+        """Consumes up to `n` samples and returns them as float32 in [-1, 1].
+
+        The returned array is a view into a buffer owned by the ring and is
+        only valid until the next call to `read` or `peek`; copy it to keep it longer.
+        """
+        out = self.peek(n)
+        self.discard(len(out))
+        return out
+
+    def peek(self, n=None):
+        """Like `read`, but leaves the samples in the buffer."""
+        n = self._size if n is None else min(n, self._size)
+        out = self._float[:n]
+        first = min(n, self.capacity - self._start)
+        np.multiply(self._samples[self._start:self._start + first], INT16_SCALE, out=out[:first])
+        np.multiply(self._samples[:n - first], INT16_SCALE, out=out[first:])
+        return out
+
+    def discard(self, n):
+        """Drops the `n` oldest samples."""
+        n = min(n, self._size)
+        self._start = (self._start + n) % self.capacity
+        self._size -= n
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+        self._pending = b""
+
+
+class CaptureRingBuffer:
+    """Lock-free single-producer / single-consumer int16 ring buffer.
+
+    Meant to sit between a real-time audio callback (the producer) and an
+    event loop (the consumer). The producer only ever advances `_written` and
+    the consumer only ever advances `_consumed`, so neither side takes a lock
+    or allocates. When the consumer falls more than `capacity` samples behind,
+    the oldest audio has been overwritten and is skipped and counted in
+    `dropped` (drop-oldest).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._samples = np.zeros(capacity, dtype=np.int16)
+        self._written = 0  # Total samples ever written, advanced by the producer only
+        self._consumed = 0  # Total samples ever consumed, advanced by the consumer only
+        self.dropped = 0
+
+    def write(self, samples):
+        """Producer side: copies an int16 array into the ring, overwriting the oldest audio."""
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+        position = (self._written + n - len(samples)) % self.capacity
+        first = min(len(samples), self.capacity - position)
+        self._samples[position:position + first] = samples[:first]
+        self._samples[:len(samples) - first] = samples[first:]
+        self._written += n  # Publish only once the samples are in place
+
+    def available(self):
+        """Samples waiting to be read (capped at the capacity)."""
+        return min(self._written - self._consumed, self.capacity)
+
+    @property
+    def position(self):
+        """Capture position, in samples, just past the last sample read (consumer side)."""
+        return self._consumed
+
+    def read(self, out):
+        """Consumer side: copies up to len(out) of the oldest samples into `out`, returns the count."""
+        written = self._written
+        start = max(self._consumed, written - self.capacity)
+        self.dropped += start - self._consumed
+        n = min(len(out), written - start)
+
+        position = start % self.capacity
+        first = min(n, self.capacity - position)
+        out[:first] = self._samples[position:position + first]
+        out[first:n] = self._samples[:n - first]
+
+        # The producer may have lapped the region we just copied; drop what it overwrote
+        lapped = min(n, self._written - self.capacity - start)
+        if lapped > 0:
+            self.dropped += lapped
+            out[:n - lapped] = out[lapped:n]
+            n -= lapped
+            start += lapped
+        self._consumed = start + n
+        return n
@@ -0,0 +1,167 @@
+import struct
+import numpy as np
+
+# Framed binary protocol of the WebSocket audio stream. Each binary message is one
+# frame: a fixed header, then the encoded samples.
+#   version  uint8   FRAME_VERSION
+#   codec    uint8   id of the codec the payload is encoded with
+#   sequence uint32  frame counter, +1 per frame
+#   timestamp uint64 capture position of the first sample, in samples at 16 kHz
+FRAME_HEADER = struct.Struct("!BBIQ")
+FRAME_VERSION = 1
+
+
+class Pcm16Codec:
+    """Uncompressed 16-bit little-endian PCM, 32 KB/s at 16 kHz."""
+    id = 0
+    name = "pcm16"
+    sample_bytes = 2
+
+    def encode(self, samples):
+        return samples.astype("<i2", copy=False).tobytes()
+
+    def decode(self, data):
+        return np.frombuffer(data, dtype="<i2").astype(np.int16, copy=False)
+
+
+def _segment(values, ends):
+    """G.711 segment number: index of the first entry of `ends` that is >= value."""
+    return np.searchsorted(np.asarray(ends), values, side="left")
+
+
+def _mulaw_encode(pcm):
+    # Sun's G.711 reference, vectorized over a 14-bit magnitude
+    pcm = pcm.astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    pcm = np.minimum(np.abs(pcm), 8159) + (0x84 >> 2)
+    seg = _segment(pcm, (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF))
+    uval = (np.minimum(seg, 7) << 4) | ((pcm >> (np.minimum(seg, 7) + 1)) & 0x0F)
+    return (np.where(seg >= 8, 0x7F, uval) ^ mask).astype(np.uint8)
+
+
+def _mulaw_decode(uval):
+    uval = ~uval.astype(np.int32) & 0xFF
+    t = (((uval & 0x0F) << 3) + 0x84) << ((uval & 0x70) >> 4)
+    return np.where(uval & 0x80, 0x84 - t, t - 0x84).astype(np.int16)
+
+
+def _alaw_encode(pcm):
+    pcm = pcm.astype(np.int32) >> 3
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    pcm = np.where(pcm >= 0, pcm, -pcm - 1)
+    seg = _segment(pcm, (0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF))
+    shift = np.where(seg < 2, 1, np.minimum(seg, 7))
+    aval = (np.minimum(seg, 7) << 4) | ((pcm >> shift) & 0x0F)
+    return (np.where(seg >= 8, 0x7F, aval) ^ mask).astype(np.uint8)
+
+
+def _alaw_decode(aval):
+    aval = aval.astype(np.int32) ^ 0x55
+    seg = (aval & 0x70) >> 4
+    t = ((aval & 0x0F) << 4) + np.where(seg == 0, 8, 0x108)
+    t = np.where(seg > 1, t << np.maximum(seg - 1, 0), t)
+    return np.where(aval & 0x80, t, -t).astype(np.int16)
+
+
+class _CompandingCodec:
+    """8-bit G.711 companding, 16 KB/s at 16 kHz: half of PCM16 at telephone quality.
+
+    Encoding and decoding are single table lookups over all 65536 inputs and all
+    256 codes, computed once with the vectorized reference formulas.
+    """
+
+    def __init__(self):
+        cls = type(self)
+        if cls._encode_table is None:
+            cls._encode_table = cls._encode_formula(np.arange(-32768, 32768, dtype=np.int32))
+            cls._decode_table = cls._decode_formula(np.arange(256, dtype=np.uint8))
+
+    def encode(self, samples):
+        return self._encode_table[samples.astype(np.int32) + 32768].tobytes()
+
+    def decode(self, data):
+        return self._decode_table[np.frombuffer(data, dtype=np.uint8)]
+
+
+class MuLawCodec(_CompandingCodec):
+    id = 1
+    name = "mulaw"
+    sample_bytes = 1
+    _encode_table = _decode_table = None
+    _encode_formula = staticmethod(_mulaw_encode)
+    _decode_formula = staticmethod(_mulaw_decode)
+
+
+class ALawCodec(_CompandingCodec):
+    id = 2
+    name = "alaw"
+    sample_bytes = 1
+    _encode_table = _decode_table = None
+    _encode_formula = staticmethod(_alaw_encode)
+    _decode_formula = staticmethod(_alaw_decode)
+
+
+# Codec name -> class. Compressed codecs (e.g. Opus, ids from 128) plug in through
+# register_codec; a codec is instantiated per session so it may keep state.
+CODECS = {}
+
+
+def register_codec(codec):
+    if any(other.id == codec.id for other in CODECS.values()):
+        raise ValueError(f"Codec id {codec.id} is already taken")
+    CODECS[codec.name] = codec
+    return codec
+
+
+for _codec in (Pcm16Codec, MuLawCodec, ALawCodec):
+    register_codec(_codec)
+
+
+def negotiate_codec(offered):
+    """Returns the first codec name in the client's preference list that is registered."""
+    for name in offered:
+        if name in CODECS:
+            return name
+    raise ValueError(f"No supported codec in {list(offered)}, supported: {list(CODECS)}")
+
+
+class FrameWriter:
+    """Client side: encodes samples and wraps them in numbered, timestamped frames."""
+
+    def __init__(self, codec_name):
+        self.codec = CODECS[codec_name]()
+        self.sequence = 0
+
+    def frame(self, samples, timestamp):
+        header = FRAME_HEADER.pack(FRAME_VERSION, self.codec.id, self.sequence & 0xFFFFFFFF, timestamp)
+        self.sequence += 1
+        return header + self.codec.encode(samples)
+
+
+class FrameReader:
+    """Server side: checks and decodes frames and detects gaps in the sequence.
+
+    `read` returns (int16 samples, timestamp, missing frames before this one).
+    The first frame sets the sequence, so a stream moved to this server mid-way
+    (e.g. by the gateway) does not count the frames it never saw as lost.
+    """
+
+    def __init__(self, codec_name):
+        self.codec = CODECS[codec_name]()
+        self.expected = None  # Next sequence number
+        self.lost_frames = 0
+
+    def read(self, data):
+        if len(data) < FRAME_HEADER.size:
+            raise ValueError("Truncated audio frame")
+        version, codec_id, sequence, timestamp = FRAME_HEADER.unpack_from(data)
+        if version != FRAME_VERSION:
+            raise ValueError(f"Unsupported frame version {version}")
+        if codec_id != self.codec.id:
+            raise ValueError(f"Frame codec {codec_id} does not match the negotiated {self.codec.name}")
+        missing = 0 if self.expected is None else (sequence - self.expected) & 0xFFFFFFFF
+        if missing >= 0x80000000:
+            missing = 0  # Late or repeated frame; decode it anyway
+        self.lost_frames += missing
+        self.expected = (sequence + 1) & 0xFFFFFFFF
+        return self.codec.decode(data[FRAME_HEADER.size:]), timestamp, missing
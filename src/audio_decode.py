@@ -0,0 +1,190 @@
+import io
+import logging
+import queue
+import subprocess
+import threading
+import wave
+from math import gcd
+import numpy as np
+from audio_buffer import INT16_SCALE
+
+SAMPLE_RATE = 16000
+RESAMPLE_BLOCK = 65536  # Outputs of one phase computed per vectorized block
+
+log = logging.getLogger(__name__)
+
+
+class DecodeError(Exception):
+    """The uploaded bytes could not be decoded as audio."""
+
+
+def _lowpass(up, down, half_len):
+    """Kaiser-windowed sinc for resampling by up/down, with gain `up` to make up for zero stuffing."""
+    cutoff = 1 / max(up, down)  # Fraction of the upsampled Nyquist frequency
+    n = np.arange(-half_len, half_len + 1)
+    return (cutoff * np.sinc(cutoff * n) * np.kaiser(len(n), 5.0) * up).astype(np.float32)
+
+
+def resample_poly(samples, up, down):
+    """Resamples float32 `samples` by the rational factor up/down with a polyphase FIR filter.
+
+    Equivalent to zero-stuffing by `up`, low-pass filtering and keeping every
+    `down`-th sample, but each output sample only touches the filter taps of
+    its own phase, so the cost is independent of `up`.
+    """
+    g = gcd(up, down)
+    up, down = up // g, down // g
+    if up == down:
+        return samples.astype(np.float32, copy=False)
+    half_len = 10 * max(up, down)
+    h = _lowpass(up, down, half_len)
+    taps = -(-len(h) // up)  # Taps per phase
+    bank = np.zeros((up, taps), dtype=np.float32)
+    for phase in range(up):
+        coeffs = h[phase::up]
+        bank[phase, :len(coeffs)] = coeffs
+
+    # Output m sits at position m * down + half_len of the filtered, upsampled signal; its
+    # phase picks the taps and taps j multiply input samples base - j. Outputs m0, m0 + up,
+    # m0 + 2 * up, ... share a phase and their bases step by `down`, so with the input laid
+    # out as `down` columns every tap of a phase reads one contiguous run of a column.
+    length = len(samples) + 3 * taps
+    padded = np.zeros(-(-length // down) * down, dtype=np.float32)
+    padded[taps:taps + len(samples)] = samples
+    columns = padded.reshape(-1, down).T.copy()  # columns[r, i] = padded[i * down + r]
+    out = np.empty(-(-len(samples) * up // down), dtype=np.float32)
+    for m0 in range(min(up, len(out))):
+        base, phase = divmod(m0 * down + half_len, up)
+        count = len(range(m0, len(out), up))
+        for start in range(0, count, RESAMPLE_BLOCK):
+            n = min(RESAMPLE_BLOCK, count - start)
+            acc = np.zeros(n, dtype=np.float32)
+            for j in range(taps):
+                q, r = divmod(base + taps - j + start * down, down)
+                acc += bank[phase, j] * columns[r, q:q + n]
+            out[m0 + start * up:m0 + (start + n) * up:up] = acc
+    return out
+
+
+def decode_wav(data, sample_rate=SAMPLE_RATE):
+    """Decodes an integer PCM WAV file in-process, downmixing to mono and resampling with resample_poly."""
+    try:
+        with wave.open(io.BytesIO(data)) as f:
+            channels, width, rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+            frames = f.readframes(f.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise DecodeError(f"Failed to decode WAV: {e}") from e
+
+    frames = frames[:len(frames) - len(frames) % (width * channels)]  # A truncated upload may end mid-frame
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2") * INT16_SCALE
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16
+                   | raw[:, 2].astype(np.int8).astype(np.int32) << 24) * np.float32(1 / 2**31)
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4") * np.float32(1 / 2**31)
+    else:
+        raise DecodeError(f"Unsupported WAV sample width: {width} bytes")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return resample_poly(samples.astype(np.float32, copy=False), sample_rate, rate)
+
+
+def ffmpeg_command(sample_rate=SAMPLE_RATE):
+    """ffmpeg reading any audio file on stdin and writing mono 16-bit PCM at `sample_rate` to stdout."""
+    return [
+        "ffmpeg", "-loglevel", "error", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "pipe:1",
+    ]
+
+
+def start_ffmpeg(cmd):
+    try:
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise DecodeError(f"Only PCM WAV audio can be decoded, ffmpeg is not available: {e}") from e
+
+
+def run_ffmpeg(process, data):
+    """Pipes an audio file through a started ffmpeg process and returns the PCM bytes."""
+    stdout, stderr = process.communicate(data)
+    if process.returncode != 0:
+        raise DecodeError(f"Failed to decode audio: {stderr.decode(errors='replace').strip()}")
+    return stdout
+
+
+def is_wav(data):
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+class FfmpegPool:
+    """Keeps `size` ffmpeg processes started and waiting on stdin for compressed uploads.
+
+    An ffmpeg process decodes exactly one input, so workers are not reused;
+    instead each one taken by a request is replaced in the background, which
+    keeps the fork/exec and ffmpeg start-up off the request path.
+    """
+
+    def __init__(self, size=2, sample_rate=SAMPLE_RATE):
+        self.cmd = ffmpeg_command(sample_rate)
+        self.idle = queue.Queue()
+        self.closed = False
+        for _ in range(size):
+            self._spawn()
+
+    def _spawn(self):
+        try:
+            process = start_ffmpeg(self.cmd)
+        except DecodeError as e:
+            if not self.closed:
+                # WAV uploads still work; other formats get a DecodeError per request
+                log.warning("Disabling the ffmpeg pool: %s", e)
+                self.close()
+            return
+        if self.closed:
+            process.kill()
+        else:
+            self.idle.put(process)
+
+    def decode(self, data):
+        """Decodes an in-memory audio file to int16 PCM bytes."""
+        try:
+            process = self.idle.get_nowait()
+        except queue.Empty:
+            process = None  # Every warm worker is busy; start one for this request
+        else:
+            # Only a worker taken from the pool is replaced, so bursts do not grow it past `size`
+            threading.Thread(target=self._spawn, daemon=True).start()
+        if process is None or process.poll() is not None:
+            process = start_ffmpeg(self.cmd)
+        return run_ffmpeg(process, data)
+
+    def close(self):
+        self.closed = True
+        while not self.idle.empty():
+            self.idle.get_nowait().kill()
+
+
+def decode_audio(data, sample_rate=SAMPLE_RATE, pool=None):
+    """Decodes an in-memory audio file to float32 mono at `sample_rate`.
+
+    Integer PCM WAV files (what the apps upload with UPLOAD_FORMAT=wav) are
+    decoded and resampled in-process. Anything else is piped through ffmpeg's
+    stdin and the PCM read back from its stdout, from the warm `pool` if one
+    is given, so nothing is written to disk.
+    """
+    if is_wav(data):
+        try:
+            return decode_wav(data, sample_rate)
+        except DecodeError:
+            pass  # e.g. float or compressed WAV, which ffmpeg handles
+    if pool is not None:
+        pcm = pool.decode(data)
+    else:
+        pcm = run_ffmpeg(start_ffmpeg(ffmpeg_command(sample_rate)), data)
+    return np.frombuffer(pcm, dtype=np.int16) * INT16_SCALE
@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import torch
+import whisper
+from whisper.tokenizer import get_tokenizer
+from mel_features import log_mel
+from metrics import Histogram, observe_stage
+
+log = logging.getLogger(__name__)
+
+# Same thresholds whisper.transcribe uses to decide that a window holds no speech
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+TIME_PRECISION = 0.02  # Seconds per timestamp token
+
+BATCH_SIZE = Histogram("transapp_inference_batch_size", "Windows per batched decode.", buckets=(1, 2, 4, 8, 16, 32))
+
+
+def transcribe_batch(model, audios, language='de', task='translate', timestamps=False, timings=None):
+    """Runs one batched mel/encode/decode pass over a list of float32 16 kHz windows.
+
+    A window may also be a log-mel spectrogram the caller already computed
+    (see IncrementalLogMel), which skips the mel stage for it.
+
+    Returns one text per window, or with `timestamps` one list of
+    (start, end, text) segments per window, where the `end` of a trailing
+    segment the model has not closed yet is None. If a `timings` dict is
+    given, the seconds spent on the mel and inference stages are stored in it.
+    """
+    start = time.perf_counter()
+    mel = torch.stack([log_mel(model, audio) for audio in audios])
+    mel_done = time.perf_counter()
+    options = whisper.DecodingOptions(language=language, task=task, without_timestamps=not timestamps,
+                                      fp16=model.device.type == "cuda")
+    results = whisper.decode(model, mel, options)
+    if timings is not None:
+        timings["mel"] = mel_done - start
+        timings["inference"] = time.perf_counter() - mel_done
+    tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages, language=language, task=task)
+
+    outputs = []
+    for result in results:
+        no_speech = result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD
+        if timestamps:
+            outputs.append([] if no_speech else _split_segments(tokenizer, result.tokens))
+        else:
+            outputs.append("" if no_speech else result.text)
+    return outputs
+
+
+def timed_transcribe_batch(model, audios, language, task, timestamps):
+    """transcribe_batch returning (outputs, stage timings), for use across threads and processes."""
+    timings = {}
+    return transcribe_batch(model, audios, language, task, timestamps, timings), timings
+
+
+def detect_language(model, audio):
+    """Returns (language code, probability) for the first 30 s of a float32 16 kHz window."""
+    if not model.is_multilingual:
+        return 'en', 1.0
+    _, probs = model.detect_language(log_mel(model, audio))
+    language = max(probs, key=probs.get)
+    return language, float(probs[language])
+
+
+def load_model(name, device=None, precision='fp32', threads=None):
+    """Loads a Whisper model for inference.
+
+    `device` is "cuda", "cpu" or None for CUDA when available. With
+    `precision="int8"` the model is loaded on CPU and its linear layers are
+    dynamically quantized to int8, which roughly halves CPU latency and
+    memory at a small accuracy cost. `threads` sets torch's intra-op threads.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    if precision == 'int8':
+        if device not in (None, 'cpu'):
+            raise ValueError("int8 inference is only supported on CPU")
+        device = 'cpu'
+    elif precision != 'fp32':
+        raise ValueError(f"Unknown precision: {precision}")
+
+    model = whisper.load_model(name, device=device)
+    if precision == 'int8':
+        # quantize_dynamic only swaps exact nn.Linear instances; Whisper's Linear
+        # subclass only adds a dtype cast, a no-op for fp32 CPU inputs
+        for module in model.modules():
+            if isinstance(module, whisper.model.Linear):
+                module.__class__ = torch.nn.Linear
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def transcribe_long(model, audio, language='de', task='translate'):
+    """Transcribes a recording of any length with Whisper's sliding 30 s window."""
+    return model.transcribe(audio, language=language, task=task, fp16=model.device.type == "cuda")['text']
+
+
+def _split_segments(tokenizer, tokens):
+    """Splits timestamped decoder output into (start, end, text) segments."""
+    segments = []
+    start = 0.0
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            time = (token - tokenizer.timestamp_begin) * TIME_PRECISION
+            if text_tokens:
+                segments.append((start, time, tokenizer.decode(text_tokens).strip()))
+                text_tokens = []
+            start = time
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append((start, None, tokenizer.decode(text_tokens).strip()))
+    return segments
+
+
+class ThreadBackend:
+    """Runs batches on an in-process model from a single worker thread."""
+
+    def __init__(self, model):
+        self.model = model
+        self.concurrency = 1
+        self.n_mels = model.dims.n_mels  # Mel bins the model expects, for callers that build features
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def transcribe_batch(self, audios, language, task, timestamps):
+        """Returns (outputs, stage timings) for a batch."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, timed_transcribe_batch, self.model, audios, language, task, timestamps)
+
+    async def transcribe_long(self, audio, language, task):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, transcribe_long, self.model, audio, language, task)
+
+    async def detect_language(self, audio):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, detect_language, self.model, audio)
+
+    async def warm_up(self):
+        pass  # The model is loaded before the backend is created
+
+
+_worker_model = None  # Model replica owned by a pool worker process
+
+
+def _init_worker(model_name, device, precision, torch_threads):
+    global _worker_model
+    _worker_model = load_model(model_name, device, precision, torch_threads)
+    log.info("Inference worker loaded %s (%s) on %s", model_name, precision, _worker_model.device)
+
+
+def _worker_transcribe_batch(audios, language, task, timestamps):
+    return timed_transcribe_batch(_worker_model, audios, language, task, timestamps)
+
+
+def _worker_transcribe_long(audio, language, task):
+    return transcribe_long(_worker_model, audio, language, task)
+
+
+def _worker_detect_language(audio):
+    return detect_language(_worker_model, audio)
+
+
+def _worker_ping():
+    return _worker_model is not None
+
+
+def _worker_n_mels():
+    return _worker_model.dims.n_mels
+
+
+class ProcessPoolBackend:
+    """Runs batches on `workers` processes, each holding its own replica of the model.
+
+    If a worker dies the pool is rebuilt and the failed batch is retried once.
+    """
+
+    def __init__(self, model_name, workers=2, torch_threads=None, device=None, precision='fp32'):
+        self.model_name = model_name
+        self.concurrency = workers
+        self.torch_threads = torch_threads
+        self.device = device
+        self.precision = precision
+        self.n_mels = None  # Known once the workers have loaded the model
+        self.context = multiprocessing.get_context("spawn")  # CUDA cannot be re-initialised in a fork
+        self.executor = self._start_pool()
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(max_workers=self.concurrency, mp_context=self.context,
+                                   initializer=_init_worker, initargs=(self.model_name, self.device, self.precision, self.torch_threads))
+
+    def _restart_pool(self, broken):
+        if self.executor is broken:  # Another batch may already have restarted it
+            log.warning("Inference worker crashed, restarting the worker pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._start_pool()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                self._restart_pool(executor)
+                if attempt:
+                    raise
+
+    async def transcribe_batch(self, audios, language, task, timestamps):
+        """Returns (outputs, stage timings) for a batch."""
+        return await self._run(_worker_transcribe_batch, audios, language, task, timestamps)
+
+    async def transcribe_long(self, audio, language, task):
+        return await self._run(_worker_transcribe_long, audio, language, task)
+
+    async def detect_language(self, audio):
+        return await self._run(_worker_detect_language, audio)
+
+    async def warm_up(self):
+        """Starts every worker and waits until they have loaded their model."""
+        await asyncio.gather(*(self._run(_worker_ping) for _ in range(self.concurrency)))
+        self.n_mels = await self._run(_worker_n_mels)
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+class InferenceScheduler:
+    """Collects windows from all connections and runs them through the model in batches.
+
+    A batch is closed as soon as it holds `max_batch_size` windows or `max_wait`
+    seconds have passed since its first window arrived, whichever comes first.
+    Up to `backend.concurrency` batches are in flight at once; while every
+    replica is busy new windows keep queueing and end up in larger batches.
+    """
+
+    def __init__(self, backend, max_batch_size=8, max_wait=0.05):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(backend.concurrency)
+        self._tasks = set()
+
+    async def transcribe(self, audio, language='de', task='translate', timestamps=False, trace=None):
+        """Queues a window for the next batch and waits for its transcription."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self.queue.put((audio, (language, task, timestamps), future, trace, loop.time()))
+        return await future
+
+    async def detect_language(self, audio):
+        """Detects the spoken language of a window; one encoder pass, not batched."""
+        return await self.backend.detect_language(audio)
+
+    async def run(self):
+        """Batches queued windows forever; run it as a background task."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()  # Wait for a free replica before closing a batch
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            # Windows decoded with different options cannot share a decode pass
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for options, items in groups.items():
+                await self._run_group(items, *options)
+        finally:
+            self._slots.release()
+
+    async def _run_group(self, items, language, task, timestamps):
+        now = asyncio.get_running_loop().time()
+        for _, _, _, trace, queued in items:
+            observe_stage("queue", now - queued, trace)
+        BATCH_SIZE.observe(len(items))
+
+        try:
+            texts, timings = await self.backend.transcribe_batch([item[0] for item in items], language, task, timestamps)
+        except Exception as e:
+            log.error("Batched inference failed: %s", e)
+            for _, _, future, _, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Stage timings are per batch; every traced window in it gets the batch's numbers
+        for stage, seconds in timings.items():
+            observe_stage(stage, seconds)
+            for _, _, _, trace, _ in items:
+                if trace is not None:
+                    trace.add(stage, seconds)
+
+        for (_, _, future, _, _), text in zip(items, texts):
+            if not future.done():  # The connection may have gone away meanwhile
+                future.set_result(text)
@@ -0,0 +1,105 @@
+import numpy as np
+import torch
+import whisper
+from whisper.audio import HOP_LENGTH, N_FFT, N_FRAMES, N_SAMPLES, mel_filters
+
+SILENCE = -10.0  # log10 of the clamped mel power of an all-zero frame
+HALF_WINDOW = N_FFT // 2  # STFT frames are centred, so each reaches this far either side of its hop
+
+
+def log_mel(model, window):
+    """Model input for a window: float32 16 kHz audio, or a spectrogram already built by IncrementalLogMel."""
+    if isinstance(window, torch.Tensor):
+        return window.to(model.device)
+    return whisper.log_mel_spectrogram(whisper.pad_or_trim(window), n_mels=model.dims.n_mels, device=model.device)
+
+
+class IncrementalLogMel:
+    """Log-mel frames of one growing stream (a speech segment), each computed once.
+
+    `features(audio, start)` returns exactly what
+    `whisper.log_mel_spectrogram(whisper.pad_or_trim(audio))` would for a window
+    that starts `start` samples into the stream. STFT frames whose samples all
+    lie inside the window do not depend on where the window starts or ends,
+    so they are computed only for audio no earlier window covered and kept
+    in a ring of N_FRAMES columns. Only the two reflect-padded frames at the
+    window's start and the few straddling its end are computed per window,
+    and the zero padding up to 30 s is copied from a constant block.
+    Windows must start on a hop (a multiple of 160 samples) to use the cache.
+    """
+
+    def __init__(self, n_mels, capacity=N_FRAMES):
+        self.n_mels = n_mels
+        self.capacity = capacity
+        self.filters = mel_filters("cpu", n_mels)
+        self.hann = torch.hann_window(N_FFT)
+        self.ring = torch.empty(n_mels, capacity)  # Frame k of the stream lives in column k % capacity
+        self.padding = torch.full((n_mels, N_FRAMES), SILENCE)
+        self.first = 0  # Cached frames are [first, end)
+        self.end = 0
+
+    def reset(self):
+        """Starts a new stream, e.g. when the segment closes."""
+        self.first = self.end = 0
+
+    def frames(self, samples):
+        """Unnormalized log10 mel frames of centred STFT windows laid end to end over `samples`."""
+        stft = torch.stft(torch.from_numpy(samples), N_FFT, HOP_LENGTH, window=self.hann, center=False,
+                          return_complex=True)
+        return torch.clamp(self.filters @ (stft.abs() ** 2), min=1e-10).log10()
+
+    def extend(self, audio, start):
+        """Caches the stream frames whose samples all lie in `audio`, which starts `start` samples in."""
+        last = (start + len(audio) - HALF_WINDOW) // HOP_LENGTH  # Last frame fully inside the audio
+        begin = self.end
+        if begin * HOP_LENGTH - HALF_WINDOW < start:
+            # The window starts past the cached frames (first call, or the start was cut); restart there
+            begin = -(-(start + HALF_WINDOW) // HOP_LENGTH)
+            self.first = begin
+        if last < begin:
+            return
+        offset = begin * HOP_LENGTH - HALF_WINDOW - start
+        new = self.frames(audio[offset:offset + (last - begin) * HOP_LENGTH + N_FFT])
+        columns = torch.arange(begin, last + 1) % self.capacity
+        self.ring[:, columns] = new
+        self.end = last + 1
+        self.first = max(self.first, self.end - self.capacity)
+
+    def fresh(self, audio, t0, t1):
+        """Window frames [t0, t1) computed directly, with whisper's reflect padding at both ends of 30 s."""
+        index = np.arange(t0 * HOP_LENGTH, (t1 - 1) * HOP_LENGTH + N_FFT) - HALF_WINDOW
+        index = np.abs(index)
+        index = np.where(index >= N_SAMPLES, 2 * (N_SAMPLES - 1) - index, index)
+        samples = np.where(index < len(audio), audio[np.minimum(index, len(audio) - 1)], 0).astype(np.float32)
+        return self.frames(samples)
+
+    def features(self, audio, start):
+        """The normalized (n_mels, N_FRAMES) model input for window `audio` at stream position `start`."""
+        audio = audio[:N_SAMPLES]
+        if start % HOP_LENGTH or not len(audio):
+            return whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=self.n_mels)
+        self.extend(audio, start)
+
+        # Window frames: reflect-padded head, cached interior, tail straddling the end of the audio, silence
+        head = -(-HALF_WINDOW // HOP_LENGTH)
+        interior_end = min(N_FRAMES, (len(audio) - HALF_WINDOW) // HOP_LENGTH + 1)
+        if len(audio) > N_SAMPLES - 2 * HALF_WINDOW:
+            audio_end = N_FRAMES  # The reflection at 30 s reaches back into the audio
+        else:
+            audio_end = min(N_FRAMES, -(-(len(audio) + HALF_WINDOW) // HOP_LENGTH))
+        parts = [self.fresh(audio, 0, min(head, audio_end))]
+        if interior_end > head:
+            k0 = start // HOP_LENGTH + head
+            k1 = start // HOP_LENGTH + interior_end
+            if self.first <= k0 and k1 <= self.end:
+                parts.append(self.ring[:, torch.arange(k0, k1) % self.capacity])
+            else:
+                parts.append(self.fresh(audio, head, interior_end))
+        tail_start = max(head, interior_end)
+        if audio_end > tail_start:
+            parts.append(self.fresh(audio, tail_start, audio_end))
+        parts.append(self.padding[:, :N_FRAMES - audio_end])
+
+        log_spec = torch.cat(parts, dim=1)
+        log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+        return (log_spec + 4.0) / 4.0
@@ -0,0 +1,189 @@
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger("transapp.trace")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def remove(self, **labels):
+        """Drops one label combination, e.g. when its connection closes."""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self._values = {}
+        super().__init__(name, help, labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Gauge that is either set directly or read from `function` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        self.function = function
+        super().__init__(name, help, labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._values = {}  # Label key -> [bucket counts..., sum, count]
+        super().__init__(name, help, labels)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def _samples(self):
+        lines = []
+        for key, entry in self._values.items():
+            for bound, count in zip(self.buckets, entry):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + ('+Inf',))} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {entry[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        """Prometheus text exposition of every registered metric."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram("transapp_stage_seconds", "Time spent per pipeline stage.", labels=("stage",))
+
+
+class Trace:
+    """Per-segment record of stage timings, logged as one JSON line when finished."""
+
+    def __init__(self, name, **attributes):
+        self.record = dict(attributes, name=name, stages={})
+        self.start = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.record["stages"][stage] = round(self.record["stages"].get(stage, 0) + seconds, 6)
+
+    def finish(self):
+        self.record["total"] = round(time.perf_counter() - self.start, 6)
+        log.info(json.dumps(self.record))
+
+
+class Tracer:
+    """Samples a fraction of segments for detailed tracing; the rate can change at runtime."""
+
+    def __init__(self, sample_rate=0.0):
+        self.sample_rate = sample_rate
+
+    def start(self, name, **attributes):
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return Trace(name, **attributes)
+        return None
+
+
+tracer = Tracer()
+
+
+def bearer_matches(authorization, token):
+    """Whether an `Authorization: Bearer <token>` header value carries `token`; always False without a token."""
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+@contextmanager
+def timed(stage, trace=None):
+    """Observes the duration of the block in STAGE_SECONDS and on `trace`, if sampled."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if trace is not None:
+            trace.add(stage, elapsed)
+
+
+def observe_stage(stage, seconds, trace=None):
+    """Records a stage duration measured elsewhere, e.g. in an inference worker."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if trace is not None:
+        trace.add(stage, seconds)
@@ -0,0 +1,29 @@
+class HypothesisBuffer:
+    """Decides which part of a rolling-window hypothesis is stable enough to commit.
+
+    Each decode of the window yields (start, end, text) segments. Leading
+    segments that are closed and read the same as in the previous decode are
+    committed; the window can then be cut at the end of the last committed
+    segment. The final segment is never committed here, since more audio may
+    still change it, and is only finalised once the speech segment closes.
+    """
+
+    def __init__(self):
+        self.previous = []  # Segment texts of the last uncommitted hypothesis
+
+    def update(self, segments):
+        """Returns the committed texts, the cut time in seconds, and the remaining partial text."""
+        committed = []
+        cut = 0.0
+        for i, (_, end, text) in enumerate(segments[:-1]):
+            if end is None or i >= len(self.previous) or self.previous[i] != text:
+                break
+            committed.append(text)
+            cut = end
+
+        remaining = [text for _, _, text in segments[len(committed):]]
+        self.previous = remaining
+        return committed, cut, " ".join(remaining)
+
+    def reset(self):
+        self.previous = []
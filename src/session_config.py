@@ -0,0 +1,78 @@
+import json
+from whisper.tokenizer import LANGUAGES
+from audio_codec import negotiate_codec
+
+SAMPLE_RATE = 16000
+TASKS = ("transcribe", "translate")
+
+
+class SessionConfig:
+    """Per-session settings: source language (or "auto"), task, target language and sample rate.
+
+    Streaming clients send them as the first WebSocket message,
+    `{"type": "config", "language": "auto", "task": "translate", "target_lang": "EN-GB", "sample_rate": 16000}`;
+    upload clients pass the same fields as query parameters. A `target_lang`
+    of None skips translation. With "auto" the language is detected once and
+    kept, or re-detected every `language_recheck_s` seconds of audio if set.
+    A streaming client that lists `codecs` in order of preference switches to
+    framed audio (see audio_codec) in the first of them the server supports;
+    without it audio is sent as bare PCM16 messages.
+    """
+
+    def __init__(self, language="de", task="translate", target_lang="EN-GB", sample_rate=SAMPLE_RATE,
+                 language_recheck_s=0, codecs=None):
+        if language != "auto" and language not in LANGUAGES:
+            raise ValueError(f"Unknown language: {language}")
+        if task not in TASKS:
+            raise ValueError(f"Unknown task: {task}")
+        if sample_rate != SAMPLE_RATE:
+            raise ValueError(f"Unsupported sample rate: {sample_rate}, send {SAMPLE_RATE} Hz audio")
+        self.language = language
+        self.task = task
+        self.target_lang = target_lang or None
+        self.sample_rate = sample_rate
+        self.language_recheck_s = float(language_recheck_s or 0)
+        if codecs is not None and not isinstance(codecs, list):
+            raise ValueError("codecs must be a list of codec names")
+        self.codec = negotiate_codec(codecs) if codecs else None
+        self.detected = None  # Language detected for "auto"
+        self.detected_at = None  # Stream position, in seconds, of the last detection
+
+    @classmethod
+    def from_dict(cls, fields, **defaults):
+        """Builds a config from a parsed message or query; missing fields take `defaults`."""
+        names = ("language", "task", "target_lang", "sample_rate", "language_recheck_s", "codecs")
+        values = dict(defaults, **{name: fields[name] for name in names if name in fields})
+        try:
+            if "sample_rate" in values:
+                values["sample_rate"] = int(values["sample_rate"])
+            return cls(**values)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid config: {e}")
+
+    @classmethod
+    def from_message(cls, message, **defaults):
+        try:
+            fields = json.loads(message)
+        except json.JSONDecodeError:
+            raise ValueError("Config message is not valid JSON")
+        if not isinstance(fields, dict) or fields.get("type") != "config":
+            raise ValueError("Expected a config message")
+        return cls.from_dict(fields, **defaults)
+
+    @property
+    def source_language(self):
+        """Language passed to Whisper; None until "auto" has been detected."""
+        return self.detected if self.language == "auto" else self.language
+
+    def needs_detection(self, position):
+        """Whether the language should be (re-)detected at stream `position` seconds."""
+        if self.language != "auto":
+            return False
+        if self.detected is None:
+            return True
+        return bool(self.language_recheck_s) and position - self.detected_at >= self.language_recheck_s
+
+    def as_dict(self):
+        return {"type": "config", "language": self.language, "task": self.task, "target_lang": self.target_lang,
+                "sample_rate": self.sample_rate, "language_recheck_s": self.language_recheck_s, "codec": self.codec}
@@ -0,0 +1,293 @@
+"""Headless streaming client for whisper_server_stream.py (or stream_gateway.py).
+
+Streams the microphone, or WAV files at real-time pace, and prints the
+transcripts as text or, with --json, every server message as a JSON line:
+
+    python stream_client.py --uri ws://localhost:42331 --language auto
+    python stream_client.py --json --speed 0 meeting.wav
+
+The GUI (translate_app_stream.py) and the load benchmark drive the same
+StreamClient. Only the standard library, numpy and the repo's audio modules
+are imported up front; websockets and sounddevice load when they are used.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+from audio_buffer import CaptureRingBuffer
+from audio_codec import FrameWriter
+from vad import SpeechGate, VoiceActivityDetector
+
+log = logging.getLogger("stream_client")
+
+SAMPLE_RATE = 16000
+TRAILING_SILENCE_S = 1.5  # Sent after a file so the server closes the last segment
+
+
+class SessionRejected(Exception):
+    """The server answered the session config with an error."""
+
+
+class StreamClient:
+    """One streaming session: sends the config, then gated audio from `capture`, and hands
+    every server message to `on_message` (a parsed dict), on the client's event loop.
+
+    The producer (an audio callback or `play`) writes into the CaptureRingBuffer
+    and calls `notify_audio`; `end_of_audio` makes the client send what is left
+    and close once the server has been quiet for `drain_timeout` seconds.
+    `notify_audio`, `end_of_audio` and `stop` may be called from any thread.
+    """
+
+    def __init__(self, uri, capture, chunk_samples, fs=SAMPLE_RATE, language="de", task="translate",
+                 target_lang="EN-GB", codecs=("pcm16",), on_message=None, on_send=None, drain_timeout=15):
+        self.uri = uri
+        self.config = {"type": "config", "language": language, "task": task, "target_lang": target_lang,
+                       "sample_rate": fs, "codecs": list(codecs)}
+        self.capture = capture  # Ring buffer filled by the producer
+        self.chunk_samples = chunk_samples
+        self.fs = fs
+        self.on_message = on_message
+        self.on_send = on_send  # Called with each audio message and the samples sent so far
+        self.drain_timeout = drain_timeout
+        self.codec = None  # Codec the server picked; None sends bare PCM16
+        self.frames = None  # FrameWriter for that codec
+        self.is_streaming = False
+        self.ended = False  # No more audio will be written
+        self.ready = asyncio.Event()  # Set once the server has accepted the config
+        self.audio_ready = asyncio.Event()  # Set when a chunk is available
+        self.sent_samples = 0
+        self.last_activity = None  # When audio was last sent or a message received
+        self.websocket = None
+        self.loop = None
+
+    async def run(self):
+        import websockets
+
+        self.loop = asyncio.get_running_loop()
+        log.info("Connecting to WebSocket server: %s", self.uri)
+        async with websockets.connect(self.uri, max_size=None) as websocket:
+            self.websocket = websocket
+            await websocket.send(json.dumps(self.config))  # Must precede the audio
+            reply = json.loads(await websocket.recv())  # The server's echo names the codec to use
+            self.dispatch(reply)
+            if reply.get("type") == "error":
+                raise SessionRejected(reply.get("message"))
+            self.codec = reply.get("codec")
+            self.frames = FrameWriter(self.codec) if self.codec else None
+            log.info("Streaming audio as %s", self.codec or "raw pcm16")
+            self.is_streaming = True
+            self.last_activity = time.perf_counter()
+            self.ready.set()
+
+            tasks = [asyncio.ensure_future(self.send_audio(websocket)), asyncio.ensure_future(self.receive(websocket))]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()  # Re-raises a send error
+                if self.ended and tasks[0] in done:
+                    await self.drain(tasks[1])
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self.is_streaming = False
+        if self.capture.dropped:
+            log.warning("Dropped %d samples while the connection stalled", self.capture.dropped)
+
+    def notify_audio(self):
+        """Wakes the sender; safe to call from the real-time audio thread."""
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.audio_ready.set)
+            except RuntimeError:
+                pass  # The loop has already been closed
+
+    def end_of_audio(self):
+        self.ended = True
+        self.notify_audio()
+
+    def stop(self):
+        """Closes the session now, without waiting for outstanding transcripts."""
+        log.info("Stopping the stream...")
+        self.is_streaming = False
+        self.notify_audio()  # Let the sender see the flag
+        if self.websocket and not self.websocket.closed:
+            asyncio.run_coroutine_threadsafe(self.websocket.close(), self.loop)
+
+    async def send_audio(self, websocket):
+        chunk = np.zeros(self.chunk_samples, dtype=np.int16)  # Reused for every chunk
+        speech_gate = SpeechGate(VoiceActivityDetector(self.fs), self.fs)  # Drops silence before sending
+        while self.is_streaming:
+            await self.audio_ready.wait()
+            self.audio_ready.clear()
+            while self.capture.available() >= self.chunk_samples or (self.ended and self.capture.available()):
+                n = self.capture.read(chunk)
+                # Only speech (plus a short pre-roll and hangover) is sent
+                voiced = speech_gate.process(chunk[:n])
+                if not len(voiced):
+                    continue
+                if self.frames:
+                    message = self.frames.frame(voiced, self.capture.position - len(voiced))
+                else:
+                    message = voiced.tobytes()
+                await websocket.send(message)
+                self.sent_samples += len(voiced)
+                self.last_activity = time.perf_counter()
+                if self.on_send:
+                    self.on_send(message, self.sent_samples)
+            if self.ended:
+                return
+
+    async def receive(self, websocket):
+        import websockets
+
+        try:
+            async for message in websocket:
+                self.last_activity = time.perf_counter()
+                try:
+                    self.dispatch(json.loads(message))
+                except json.JSONDecodeError:
+                    log.warning("Failed to parse server message: %s", message)
+        except websockets.ConnectionClosed as e:
+            log.info("WebSocket connection closed: %s", e)
+
+    async def drain(self, receiver):
+        """Waits until the server has been quiet for drain_timeout seconds, or closes."""
+        while not receiver.done():
+            remaining = self.last_activity + self.drain_timeout - time.perf_counter()
+            if remaining <= 0:
+                break
+            await asyncio.wait([receiver], timeout=min(remaining, 0.5))
+
+    def dispatch(self, response):
+        if self.on_message:
+            self.on_message(response)
+
+
+async def play(client, audio, speed=1.0):
+    """Writes int16 `audio` into the client's capture ring at `speed` times real time, like an
+    audio callback, then ends the stream. Waits for the session to be accepted first."""
+    await client.ready.wait()
+    chunk_samples = client.chunk_samples
+    audio = np.concatenate((audio, np.zeros(int(TRAILING_SILENCE_S * client.fs), dtype=np.int16)))
+    start = time.perf_counter()
+    for offset in range(0, len(audio), chunk_samples):
+        client.capture.write(audio[offset:offset + chunk_samples])
+        client.notify_audio()
+        if speed > 0:
+            delay = start + (offset + chunk_samples) / client.fs / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)
+    client.end_of_audio()
+
+
+def load_wav(path, sample_rate=SAMPLE_RATE):
+    """Reads a PCM WAV file as mono int16 samples at `sample_rate`."""
+    from audio_decode import decode_wav
+
+    with open(path, "rb") as f:
+        audio = decode_wav(f.read(), sample_rate)
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+
+class MicrophoneSource:
+    """Feeds a client from the default input device; the audio callback only copies and signals."""
+
+    def __init__(self, client, fs=SAMPLE_RATE):
+        self.client = client
+        self.fs = fs
+        self.input_overflows = 0  # Callbacks that reported an input overflow
+        self.stream = None
+
+    def start(self):
+        import sounddevice as sd
+
+        self.stream = sd.InputStream(samplerate=self.fs, channels=1, dtype='int16', callback=self.callback)
+        self.stream.start()
+
+    def callback(self, indata, frames, time, status):
+        if status.input_overflow:
+            self.input_overflows += 1
+        self.client.capture.write(indata[:, 0])
+        if self.client.capture.available() >= self.client.chunk_samples:
+            self.client.notify_audio()
+
+    def stop(self):
+        if self.stream:
+            self.stream.stop()
+            self.stream.close()
+            if self.input_overflows:
+                log.warning("Audio input overflowed %d times", self.input_overflows)
+
+
+def print_message(response, as_json):
+    if as_json:
+        print(json.dumps(response, ensure_ascii=False), flush=True)
+    elif response.get("type") == "final" and response.get("transcription"):
+        print(response["transcription"], flush=True)
+    elif response.get("type") == "language":
+        log.info("Detected language: %s", response.get("language"))
+    elif response.get("type") == "error":
+        log.error("Server error: %s", response.get("message"))
+
+
+async def stream(args, path=None):
+    chunk_samples = SAMPLE_RATE * args.chunk_ms // 1000
+    client = StreamClient(args.uri, CaptureRingBuffer(int(SAMPLE_RATE * args.buffer_s)), chunk_samples,
+                          language=args.language, task=args.task, target_lang=args.target_lang or None,
+                          codecs=args.codecs.split(","), on_message=lambda response: print_message(response, args.json),
+                          drain_timeout=args.drain_timeout)
+    if path is None:
+        microphone = MicrophoneSource(client)
+        microphone.start()
+        try:
+            await client.run()
+        finally:
+            microphone.stop()
+    else:
+        player = asyncio.ensure_future(play(client, load_wav(path), args.speed))
+        try:
+            await client.run()
+        finally:
+            player.cancel()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    endpoint = os.environ.get("TRANSCRIPTION_ENDPOINT", "localhost:42331").replace("http://", "")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="WAV files to stream, one session each; the microphone if none")
+    parser.add_argument("--uri", default=f"ws://{endpoint}")
+    parser.add_argument("--language", default=os.environ.get("STREAM_LANGUAGE", "de"), help="Spoken language, or auto")
+    parser.add_argument("--task", default=os.environ.get("STREAM_TASK", "translate"))
+    parser.add_argument("--target-lang", default=os.environ.get("STREAM_TARGET_LANG", "EN-GB"),
+                        help="DeepL target language, empty to skip translation")
+    parser.add_argument("--codecs", default=os.environ.get("STREAM_CODECS", "mulaw,pcm16"))
+    parser.add_argument("--chunk-ms", type=int, default=int(os.environ.get("STREAM_CHUNK_MS", 250)))
+    parser.add_argument("--buffer-s", type=float, default=float(os.environ.get("STREAM_BUFFER_S", 10)))
+    parser.add_argument("--speed", type=float, default=1.0, help="File pacing relative to real time, 0 is unpaced")
+    parser.add_argument("--drain-timeout", type=float, default=15, help="Quiet time after a file that ends its session")
+    parser.add_argument("--json", action="store_true", help="Print every server message as a JSON line")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), stream=sys.stderr,
+                        format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    try:
+        for path in args.files or [None]:
+            asyncio.run(stream(args, path))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, SessionRejected) as e:
+        log.error("%s", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
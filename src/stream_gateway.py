@@ -0,0 +1,381 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlparse
+import websockets
+from dotenv import load_dotenv
+from audio_codec import CODECS, FRAME_HEADER
+from metrics import REGISTRY, Counter, Gauge
+
+load_dotenv()
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+log = logging.getLogger("stream_gateway")
+
+# Clients connect to the gateway instead of whisper_server_stream.py; each session is
+# relayed to one worker for its whole life. GATEWAY_WORKERS lists the worker URLs;
+# GATEWAY_LOCAL_WORKERS=N also starts N local workers on the ports after GATEWAY_PORT.
+GATEWAY_PORT = int(os.environ.get("GATEWAY_PORT", 42331))
+GATEWAY_WORKERS = [url.strip() for url in os.environ.get("GATEWAY_WORKERS", "").split(",") if url.strip()]
+GATEWAY_LOCAL_WORKERS = int(os.environ.get("GATEWAY_LOCAL_WORKERS", 0))
+SAMPLE_RATE = 16000
+
+# Workers are polled on /load every HEALTH_INTERVAL_S; after UNHEALTHY_AFTER failed polls
+# in a row a worker is down and its sessions move to the others
+HEALTH_INTERVAL_S = float(os.environ.get("GATEWAY_HEALTH_INTERVAL_S", 2))
+UNHEALTHY_AFTER = int(os.environ.get("GATEWAY_UNHEALTHY_AFTER", 2))
+# A draining worker gets no new sessions; those still open after DRAIN_TIMEOUT_S are moved
+DRAIN_TIMEOUT_S = float(os.environ.get("GATEWAY_DRAIN_TIMEOUT_S", 300))
+# Audio not yet covered by a final transcription is kept, up to REPLAY_S, and replayed
+# to the next worker when a session moves, so the open utterance is not lost
+REPLAY_S = float(os.environ.get("GATEWAY_REPLAY_S", 30))
+CONNECT_TIMEOUT_S = float(os.environ.get("GATEWAY_CONNECT_TIMEOUT_S", 5))
+
+# Metrics served on GET /metrics next to the WebSocket endpoint
+session_ids = itertools.count(1)
+sessions = set()  # Open GatewaySessions
+Gauge("transapp_gateway_sessions", "Client sessions relayed by the gateway.", function=lambda: len(sessions))
+MOVED_SESSIONS = Counter("transapp_gateway_moved_sessions_total", "Sessions moved to another worker.", labels=("reason",))
+REFUSED_SESSIONS = Counter("transapp_gateway_refused_sessions_total", "Sessions refused with no worker available.")
+WORKER_LOAD = Gauge("transapp_gateway_worker_load", "Sessions plus queued windows reported by a worker.",
+                    labels=("worker",))
+WORKER_UP = Gauge("transapp_gateway_worker_up", "1 if the worker takes new sessions.", labels=("worker",))
+
+
+class Worker:
+    """One whisper_server_stream.py instance and the gateway's view of its health and load.
+
+    `state` is "up", "draining" (no new sessions, waiting for open ones to end),
+    "drained" or "down".
+    """
+
+    def __init__(self, url, process=None):
+        self.url = url
+        self.process = process  # Popen of a local worker
+        self.state = "down"  # Until the first health check answers
+        self.sessions = set()  # GatewaySessions relayed to this worker
+        self.reported_sessions = 0
+        self.queue_depth = 0
+        self.max_sessions = 0
+        self.failures = 0
+        self.drain_started = None
+
+    @property
+    def load_url(self):
+        url = urlparse(self.url)
+        return f"{'https' if url.scheme == 'wss' else 'http'}://{url.netloc}/load"
+
+    @property
+    def load(self):
+        # Sessions placed since the last poll count at once, so a burst is spread out
+        return max(self.reported_sessions, len(self.sessions)) + self.queue_depth
+
+    @property
+    def full(self):
+        return bool(self.max_sessions) and max(self.reported_sessions, len(self.sessions)) >= self.max_sessions
+
+    def as_dict(self):
+        return {"url": self.url, "state": self.state, "sessions": len(self.sessions),
+                "reported_sessions": self.reported_sessions, "queue_depth": self.queue_depth, "load": self.load}
+
+
+class WorkerPool:
+    """Places sessions on the least-loaded healthy worker and watches the workers' health."""
+
+    def __init__(self, workers):
+        self.workers = {worker.url: worker for worker in workers}
+
+    def pick(self, exclude=()):
+        """The least-loaded worker that takes new sessions, or None."""
+        candidates = [worker for worker in self.workers.values()
+                      if worker.state == "up" and not worker.full and worker not in exclude]
+        return min(candidates, key=lambda worker: worker.load, default=None)
+
+    def drain(self, url):
+        worker = self.workers[url]
+        if worker.state in ("up", "down"):
+            log.info("Draining worker %s, %d sessions open", url, len(worker.sessions))
+            worker.state = "draining"
+            worker.drain_started = time.monotonic()
+            WORKER_UP.set(0, worker=url)
+
+    def restore(self, url):
+        worker = self.workers[url]
+        if worker.state in ("draining", "drained"):
+            log.info("Restoring worker %s", url)
+            worker.state = "down"  # Back to "up" at its next successful health check
+            worker.failures = UNHEALTHY_AFTER
+
+    async def check(self, worker):
+        """Polls one worker's /load and updates its state."""
+        try:
+            response = await asyncio.to_thread(urllib.request.urlopen, worker.load_url, timeout=HEALTH_INTERVAL_S)
+            with response:
+                load = json.loads(response.read())
+        except (OSError, ValueError) as e:
+            worker.failures += 1
+            if worker.state == "up" and worker.failures >= UNHEALTHY_AFTER:
+                log.warning("Worker %s is down: %s", worker.url, e)
+                worker.state = "down"
+                WORKER_UP.set(0, worker=worker.url)
+            if worker.state in ("down", "draining") and worker.failures >= UNHEALTHY_AFTER:
+                for session in list(worker.sessions):
+                    session.move("worker_down")
+            return
+        worker.failures = 0
+        worker.reported_sessions = load.get("sessions", 0)
+        worker.queue_depth = load.get("queue_depth", 0)
+        worker.max_sessions = load.get("max_sessions", 0)
+        WORKER_LOAD.set(worker.load, worker=worker.url)
+        if worker.state == "down":
+            log.info("Worker %s is up", worker.url)
+            worker.state = "up"
+            WORKER_UP.set(1, worker=worker.url)
+
+    def check_drains(self):
+        for worker in self.workers.values():
+            if worker.state != "draining":
+                continue
+            if not worker.sessions:
+                log.info("Worker %s drained", worker.url)
+                worker.state = "drained"
+            elif time.monotonic() - worker.drain_started > DRAIN_TIMEOUT_S:
+                for session in list(worker.sessions):
+                    session.move("drain_timeout")
+
+    async def run(self):
+        """Health-checks the workers forever; run it as a background task."""
+        while True:
+            await asyncio.gather(*(self.check(worker) for worker in self.workers.values()
+                                   if worker.state != "drained"))
+            self.check_drains()
+            await asyncio.sleep(HEALTH_INTERVAL_S)
+
+
+class WorkerFailed(Exception):
+    """The connection to the worker broke, or the gateway asked the session to move."""
+
+
+class GatewaySession:
+    """Relays one client connection to a worker, moving it to another worker if that one fails.
+
+    Messages pass through unchanged except that, after a move, the new
+    worker's config echo is dropped and the stream positions it reports are
+    shifted to the client's timeline. The config message and the audio since
+    the last final transcription are replayed to the new worker.
+    """
+
+    def __init__(self, client, pool):
+        self.id = next(session_ids)
+        self.client = client
+        self.pool = pool
+        self.worker = None
+        self.backend = None
+        self.config = None  # The client's config message, if it sent one
+        self.codec = None  # Negotiated codec class; None for bare PCM16
+        self.echoed = False  # Whether the client has had the config echo
+        self.pending = deque()  # (start, end, message) audio not yet covered by a final, in samples
+        self.position = 0  # Samples forwarded so far; the timeline every worker reports on
+        self.offset = 0  # Position of the current worker's stream start, in samples
+        self.moving = None  # Reason the gateway asked this session to move
+
+    def move(self, reason):
+        """Closes the worker connection; the session reconnects to another worker."""
+        if self.backend is not None and self.moving is None:
+            self.moving = reason
+            asyncio.ensure_future(self.backend.close())
+
+    async def run(self):
+        tried = set()
+        while True:
+            worker = self.pool.pick(exclude=tried)
+            if worker is None:
+                REFUSED_SESSIONS.inc()
+                log.warning("Session %s: no worker available", self.id)
+                await self.client.close(code=1013, reason="No worker available, retry later")
+                return
+            try:
+                self.backend = await websockets.connect(worker.url, open_timeout=CONNECT_TIMEOUT_S)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake) as e:
+                log.warning("Session %s: worker %s refused the connection: %s", self.id, worker.url, e)
+                tried.add(worker)  # Full or failing; health checks will catch up
+                continue
+
+            self.worker = worker
+            worker.sessions.add(self)
+            log.info("Session %s relayed to %s", self.id, worker.url)
+            try:
+                await self.replay()
+                await self.relay()
+                return
+            except WorkerFailed as e:
+                reason = self.moving or "connection_lost"
+                log.warning("Session %s moving off %s (%s): %s", self.id, worker.url, reason, e)
+                MOVED_SESSIONS.inc(reason=reason)
+                tried = {worker}
+            finally:
+                worker.sessions.discard(self)
+                self.moving = None
+                await self.backend.close()
+
+    async def replay(self):
+        """Sends the config and the unfinished audio to a newly connected worker."""
+        self.offset = self.pending[0][0] if self.pending else self.position
+        try:
+            if self.config is not None:
+                await self.backend.send(self.config)
+            for _, _, message in self.pending:
+                await self.backend.send(message)
+        except websockets.ConnectionClosed as e:
+            raise WorkerFailed(e)
+
+    async def relay(self):
+        stages = [asyncio.create_task(stage) for stage in (self.upstream(), self.downstream())]
+        try:
+            done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in stages:
+                task.cancel()
+        for task in done:
+            task.result()  # Re-raises WorkerFailed
+
+    async def upstream(self):
+        """Client -> worker. Ends when the client closes."""
+        async for message in self.client:
+            if isinstance(message, bytes):
+                self.track(message)
+            elif not self.position and self.config is None:
+                self.config = message
+            try:
+                await self.backend.send(message)
+            except websockets.ConnectionClosed as e:
+                raise WorkerFailed(e)  # The message is in `pending` and is replayed
+
+    async def downstream(self):
+        """Worker -> client. A clean close from the worker ends the session; anything else moves it."""
+        try:
+            async for message in self.backend:
+                message = self.rewrite(message)
+                if message is not None:
+                    await self.client.send(message)
+        except websockets.ConnectionClosedError as e:
+            raise WorkerFailed(e)
+        if self.moving or self.backend.close_code in (1001, 1011, 1012, 1013):
+            raise WorkerFailed(f"closed with code {self.backend.close_code}")
+        # The worker ended the session (e.g. a rejected config); pass the close on
+        await self.client.close(code=self.backend.close_code or 1000, reason=self.backend.close_reason or "")
+
+    def track(self, message):
+        """Records an audio message's stream position and keeps it for replay.
+
+        Positions count the samples the worker receives, as its `audio_end` does. A
+        frame's header timestamp is the client's capture position, which also counts
+        the silence the client's VAD never sent, so it is not used here.
+        """
+        if self.codec is None:
+            samples = len(message) // 2
+        else:
+            samples = (len(message) - FRAME_HEADER.size) // self.codec.sample_bytes
+        start, end = self.position, self.position + samples
+        self.position = end
+        self.pending.append((start, end, message))
+        while self.pending and self.position - self.pending[0][0] > REPLAY_S * SAMPLE_RATE:
+            self.pending.popleft()
+
+    def rewrite(self, message):
+        if isinstance(message, bytes):
+            return message
+        try:
+            response = json.loads(message)
+        except json.JSONDecodeError:
+            return message
+        if response.get("type") == "config":
+            if self.echoed:
+                return None  # The client already has it; this worker got a replayed config
+            self.echoed = True
+            self.codec = CODECS.get(response.get("codec"))
+        for key in ("audio_start", "audio_end"):
+            if key in response:
+                response[key] += self.offset / SAMPLE_RATE
+        if response.get("type") == "final" and "audio_end" in response:
+            # Audio before this point is transcribed and need not be replayed
+            done = response["audio_end"] * SAMPLE_RATE
+            while self.pending and self.pending[0][1] <= done:
+                self.pending.popleft()
+        return json.dumps(response)
+
+
+async def relay_session(client, path):
+    session = GatewaySession(client, pool)
+    sessions.add(session)
+    try:
+        log.info("New connection %s from %s", session.id, client.remote_address)
+        await session.run()
+    except websockets.exceptions.ConnectionClosedError as e:
+        log.info("Connection %s closed: %s", session.id, e)
+    except Exception as e:
+        log.exception("Error occurred: %s", e)
+    finally:
+        sessions.discard(session)
+
+
+async def serve_http(path, request_headers):
+    """Answers plain HTTP requests on the gateway port: /metrics and /workers."""
+    url = urlparse(path)
+    if url.path == "/metrics":
+        return HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4")], REGISTRY.render().encode()
+    if url.path == "/workers":
+        # /workers?drain=URL stops new sessions on a worker, /workers?restore=URL undoes it
+        query = parse_qs(url.query)
+        for action, apply in (("drain", pool.drain), ("restore", pool.restore)):
+            for worker_url in query.get(action, []):
+                if worker_url not in pool.workers:
+                    return HTTPStatus.NOT_FOUND, [], f"Unknown worker {worker_url}\n".encode()
+                apply(worker_url)
+        workers = [worker.as_dict() for worker in pool.workers.values()]
+        return HTTPStatus.OK, [("Content-Type", "application/json")], json.dumps(workers).encode()
+    return None  # Everything else is a WebSocket handshake
+
+
+def start_local_workers(count):
+    """Starts `count` whisper_server_stream.py processes on the ports after GATEWAY_PORT."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "whisper_server_stream.py")
+    workers = []
+    for i in range(count):
+        port = GATEWAY_PORT + 1 + i
+        process = subprocess.Popen([sys.executable, script], env=dict(os.environ, PORT=str(port)))
+        workers.append(Worker(f"ws://localhost:{port}", process))
+    return workers
+
+
+pool = None  # Created in main()
+
+
+async def main():
+    global pool
+    workers = [Worker(url) for url in GATEWAY_WORKERS] + start_local_workers(GATEWAY_LOCAL_WORKERS)
+    if not workers:
+        raise SystemExit("Set GATEWAY_WORKERS and/or GATEWAY_LOCAL_WORKERS")
+    pool = WorkerPool(workers)
+    health_task = asyncio.create_task(pool.run())
+    try:
+        async with websockets.serve(relay_session, "0.0.0.0", GATEWAY_PORT, process_request=serve_http):
+            log.info("Gateway started at port %d for %d workers...", GATEWAY_PORT, len(workers))
+            await asyncio.Future()  # Run forever
+    finally:
+        health_task.cancel()
+        for worker in workers:
+            if worker.process is not None:
+                worker.process.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
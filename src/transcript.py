@@ -0,0 +1,88 @@
+import json
+import os
+import queue
+import threading
+import time
+
+JOURNAL_BATCH_SIZE = 50  # Entries written per batch at most
+JOURNAL_FLUSH_S = 1.0  # Longest an entry waits before it is written
+
+
+class TranscriptJournal:
+    """Append-only on-disk log of a session's full transcript, one JSON line per final segment.
+
+    `append` only queues the entry; a background thread writes queued entries
+    in batches, so the caller (the GUI thread) never waits on the disk.
+    `search` and `export` read the file back line by line, so they work on
+    transcripts of any length with flat memory.
+    """
+
+    def __init__(self, path, batch_size=JOURNAL_BATCH_SIZE, flush_interval=JOURNAL_FLUSH_S):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self.write_batches, daemon=True)
+        self.writer.start()
+
+    def append(self, text, audio_end=None):
+        entry = {"time": time.time(), "text": text}
+        if audio_end is not None:
+            entry["audio_end"] = audio_end
+        self.queue.put(entry)
+
+    def write_batches(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                batch = [self.queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while batch[-1] is not None and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch if entry is not None)
+                f.flush()
+                for _ in batch:
+                    self.queue.task_done()
+                if batch[-1] is None:
+                    return
+
+    def flush(self):
+        """Waits until every appended entry is on disk."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+
+    def entries(self):
+        """Yields the journal's entries, oldest first."""
+        self.flush()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def search(self, query, limit=100):
+        """Entries whose text contains `query`, case-insensitively; at most `limit`, oldest first."""
+        query = query.lower()
+        matches = []
+        for entry in self.entries():
+            if query in entry["text"].lower():
+                matches.append(entry)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def export(self, path):
+        """Writes the transcript as plain text, one `[HH:MM:SS] text` line per segment."""
+        with open(path, "w", encoding="utf-8") as f:
+            for entry in self.entries():
+                f.write(f"{format_entry(entry)}\n")
+
+
+def format_entry(entry):
+    return f"[{time.strftime('%H:%M:%S', time.localtime(entry['time']))}] {entry['text']}"
@@ -1,11 +1,14 @@
 import sys
+import struct
+import subprocess
+import threading
+import uuid
 import sounddevice as sd
 import numpy as np
-import wave
+from queue import Queue
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QMessageBox
 from PyQt5.QtGui import QIcon, QPixmap
-from PyQt5.QtCore import QSize, Qt, QThread
-from pydub import AudioSegment
+from PyQt5.QtCore import QSize, Qt, QThread, pyqtSignal
 import requests
 import os
 from dotenv import load_dotenv
@@ -13,34 +16,141 @@ load_dotenv()
 
 TRANSCRIPTION_ENDPOINT = os.environ.get("TRANSCRIPTION_ENDPOINT", None)
 
-class RecordThread(QThread):
-    def __init__(self, parent=None, fs=44100):
-        super().__init__(parent)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# "mp3" encodes on the client; "wav" uploads 16 kHz PCM that the server decodes
+# without ffmpeg, at about twice the bytes of the MP3
+UPLOAD_FORMAT = os.environ.get("UPLOAD_FORMAT", "mp3")
+WAV_SAMPLE_RATE = 16000
+session = requests.Session()  # Pooled connection to the transcription endpoint
+
+
+class Recorder:
+    """Records microphone audio into a growable stream of chunks, with no duration cap.
+
+    The audio callback only copies each block onto a queue; consumers read
+    them with `chunks()` while the recording is still going.
+    """
+
+    def __init__(self, fs=44100):
         self.fs = fs
-        self.is_recording = False
-        self.recording_data = None
-        self.duration = 60  # Maximum recording duration in seconds
+        self.queue = Queue()
+        self.stream = None
 
-    def run(self):
-        """Starts recording audio in a separate thread."""
-        self.is_recording = True
-        self.recording_data = sd.rec(int(self.duration * self.fs), samplerate=self.fs, channels=1, dtype='int16')
-        sd.wait()  # Blocking wait inside the thread
+    def start(self):
+        self.stream = sd.InputStream(samplerate=self.fs, channels=1, dtype='int16', callback=self.callback)
+        self.stream.start()
+
+    def callback(self, indata, frames, time, status):
+        self.queue.put(indata.tobytes())
 
     def stop(self):
-        """Stops the recording."""
-        if self.is_recording:
-            sd.stop()
-            self.is_recording = False
+        if self.stream:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+            self.queue.put(None)  # End of recording
+
+    def chunks(self):
+        """Yields 16-bit PCM chunks as they are recorded, until `stop` is called."""
+        while (chunk := self.queue.get()) is not None:
+            yield chunk
+
+
+def encode_mp3(pcm_chunks, fs):
+    """Yields MP3 bytes while PCM is still arriving, streaming it through ffmpeg's pipes."""
+    process = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-f", "s16le", "-ar", str(fs), "-ac", "1", "-i", "pipe:0", "-f", "mp3", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            for chunk in pcm_chunks:
+                process.stdin.write(chunk)
+        except OSError:
+            pass  # The encoder was stopped, e.g. because the upload failed
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    threading.Thread(target=feed, daemon=True).start()
+    try:
+        while data := process.stdout.read1(UPLOAD_CHUNK_SIZE):
+            yield data
+        if process.wait() != 0:
+            raise RuntimeError("MP3 encoding failed")
+    finally:
+        # An abandoned upload closes the generator early; stop ffmpeg so `feed` stops writing to it
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def stream_wav(pcm_chunks, fs):
+    """Yields a mono 16-bit WAV file while PCM is still arriving.
+
+    The length is unknown until the recording stops, so the header carries the
+    0xFFFFFFFF placeholder sizes used by streaming WAV writers.
+    """
+    yield (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVEfmt "
+           + struct.pack("<IHHIIHH", 16, 1, 1, fs, fs * 2, 2, 16)
+           + b"data" + struct.pack("<I", 0xFFFFFFFF))
+    yield from pcm_chunks
+
+
+def multipart_body(file_chunks, boundary, filename="recorded_audio.mp3", content_type="audio/mpeg"):
+    """Wraps a stream of file chunks into a multipart/form-data body with a `file` field."""
+    yield (f"--{boundary}\r\n"
+           f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+           f"Content-Type: {content_type}\r\n\r\n").encode()
+    yield from file_chunks
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+class UploadThread(QThread):
+    """Uploads a recording with chunked transfer encoding while it is being made."""
+    finished_upload = pyqtSignal(str, str)  # Title and message to show
+
+    def __init__(self, file_chunks, filename="recorded_audio.mp3", content_type="audio/mpeg", parent=None):
+        super().__init__(parent)
+        self.file_chunks = file_chunks
+        self.filename = filename
+        self.content_type = content_type
+
+    def run(self):
+        boundary = uuid.uuid4().hex
+        body = multipart_body(self.file_chunks, boundary, self.filename, self.content_type)
+        try:
+            # A generator body makes requests send it chunked as it is produced
+            response = session.post(TRANSCRIPTION_ENDPOINT, data=body,
+                                    headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+            if response.status_code == 200:
+                transcription_result = response.json().get("transcription", "No transcription found.")
+                # Show the transcription result
+                self.finished_upload.emit("Transcription", transcription_result)
+            elif response.status_code == 503:
+                # The server only admits an upload once it has the whole recording
+                retry_after = response.headers.get("Retry-After", "a few")
+                self.finished_upload.emit("Server busy", f"The server is busy, try again in {retry_after} seconds.")
+            else:
+                self.finished_upload.emit("Error", f"Failed to transcribe: {response.status_code}")
+        except Exception as e:
+            self.finished_upload.emit("Error", f"An error occurred: {str(e)}")
+        finally:
+            body.close()  # Stops the encoder if the upload ended before the recording
 
 
 class MP3UploaderApp(QWidget):
     def __init__(self):
         super().__init__()
         self.initUI()
-        self.fs = 44100  # Sample rate (44.1 kHz)
-        self.record_thread = None
-        self.wav_file = "recorded_audio.wav"
+        # Sample rate: 44.1 kHz for MP3, 16 kHz (what Whisper uses) for WAV uploads
+        self.fs = WAV_SAMPLE_RATE if UPLOAD_FORMAT == "wav" else 44100
+        self.recorder = None
+        self.upload_threads = set()  # Uploads still running; a QThread must outlive its run()
 
     def initUI(self):
         # Set window properties
@@ -91,66 +201,41 @@ class MP3UploaderApp(QWidget):
             self.stop_recording()
 
     def start_recording(self):
-        """Starts recording audio from the microphone in a separate thread."""
+        """Starts recording and uploads the audio, encoded in memory, while it is recorded."""
         self.label.setText("Recording... Click again to stop.")
-        self.record_thread = RecordThread(fs=self.fs)
-        self.record_thread.start()  # Start the recording in the background
-
-    def stop_recording(self):
-        """Stops recording and processes the audio."""
-        self.label.setText("Recording stopped. Processing audio...")
-
-        # Stop the recording
-        if self.record_thread:
-            self.record_thread.stop()
-            self.record_thread.wait()  # Ensure the thread has finished
-
-            # Save the recording to a WAV file
-            self.save_wav_file(self.wav_file, self.record_thread.recording_data)
-
-            # Convert to MP3
-            mp3_file = self.convert_wav_to_mp3(self.wav_file)
-
-            # Upload and transcribe the MP3 file
-            self.upload_and_transcribe(mp3_file)
-
-            # Clean up files
-            os.remove(self.wav_file)
-            os.remove(mp3_file)
-
-    def save_wav_file(self, file_name, recording):
-        """Saves the recorded audio to a WAV file."""
-        with wave.open(file_name, 'wb') as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)  # 2 bytes per sample
-            wf.setframerate(self.fs)
-            wf.writeframes(recording.tobytes())
-
-    def convert_wav_to_mp3(self, wav_file):
-        """Converts the recorded WAV file to MP3 using PyDub and FFmpeg."""
-        mp3_file = "recorded_audio.mp3"
-        audio = AudioSegment.from_wav(wav_file)
-        audio.export(mp3_file, format="mp3")
-        return mp3_file
-
-    def upload_and_transcribe(self, mp3_file):
-        """Uploads the MP3 file and sends a POST request to the transcription endpoint."""
-        try:
-            # Display message that the request is in progress
-            self.show_message("Uploading", "Uploading MP3 and waiting for transcription...")
+        self.recorder = Recorder(fs=self.fs)
+        self.recorder.start()
 
-            # Send POST request with the MP3 file
-            files = {'file': open(mp3_file, 'rb')}
-            response = requests.post(TRANSCRIPTION_ENDPOINT, files=files)
+        if UPLOAD_FORMAT == "wav":
+            upload_thread = UploadThread(stream_wav(self.recorder.chunks(), self.fs), "recorded_audio.wav", "audio/wav")
+        else:
+            upload_thread = UploadThread(encode_mp3(self.recorder.chunks(), self.fs))
+        # The previous upload may still be waiting for its transcription; keep each one until it ends
+        self.upload_threads.add(upload_thread)
+        upload_thread.finished.connect(lambda: self.upload_threads.discard(upload_thread))
+        recorder = self.recorder
+        upload_thread.finished_upload.connect(lambda title, message: self.upload_finished(recorder, title, message))
+        upload_thread.start()
 
-            if response.status_code == 200:
-                transcription_result = response.json().get("transcription", "No transcription found.")
-                # Show the transcription result
-                self.show_message("Transcription", transcription_result)
-            else:
-                self.show_message("Error", f"Failed to transcribe: {response.status_code}")
-        except Exception as e:
-            self.show_message("Error", f"An error occurred: {str(e)}")
+    def stop_recording(self):
+        """Stops recording; the upload finishes in the background."""
+        self.label.setText("Recording stopped. Waiting for transcription...")
+
+        # Stop the recording, which ends the upload body
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
+
+    def upload_finished(self, recorder, title, message):
+        """Shows the result of the upload of `recorder`'s recording once the server has answered."""
+        if recorder is self.recorder:
+            # The upload ended while still recording, so it failed; nothing reads the recording anymore
+            self.recorder.stop()
+            self.recorder = None
+            self.record_button.setChecked(False)
+        if self.recorder is None:
+            self.label.setText("Click the button to start/stop recording")
+        self.show_message(title, message)
 
     def show_message(self, title, message):
         """Displays a message box with a title and message."""
@@ -1,19 +1,33 @@
 import sys
 import os
-import json
-import sounddevice as sd
-import numpy as np
-import wave
 import asyncio
-import websockets
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QTextEdit
-from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import QSize, Qt, QThread, pyqtSignal
-from queue import Queue
+import logging
+import time
+from collections import deque
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QListView,
+                             QLineEdit, QFileDialog, QMessageBox)
+from PyQt5.QtGui import QColor, QIcon
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QSize, QStandardPaths, Qt, QThread, pyqtSignal
+from audio_buffer import CaptureRingBuffer
+from stream_client import MicrophoneSource, StreamClient
+from transcript import TranscriptJournal, format_entry
 from dotenv import load_dotenv
 load_dotenv()
 
 TRANSCRIPTION_ENDPOINT = os.environ.get("TRANSCRIPTION_ENDPOINT", None)
+STREAM_CHUNK_MS = int(os.environ.get("STREAM_CHUNK_MS", 250))  # Audio sent per WebSocket frame
+STREAM_BUFFER_S = int(os.environ.get("STREAM_BUFFER_S", 10))  # Audio kept while the network stalls
+# Session config sent to the server; STREAM_LANGUAGE=auto lets the server detect the language once
+STREAM_LANGUAGE = os.environ.get("STREAM_LANGUAGE", "de")
+STREAM_TASK = os.environ.get("STREAM_TASK", "translate")
+STREAM_TARGET_LANG = os.environ.get("STREAM_TARGET_LANG", "EN-GB")
+# Audio codecs offered to the server, in order of preference; mulaw halves the bandwidth of pcm16
+STREAM_CODECS = os.environ.get("STREAM_CODECS", "mulaw,pcm16")
+# The window shows the last TRANSCRIPT_WINDOW_LINES segments; the full transcript of each
+# session is journaled to TRANSCRIPT_DIR (by default in the user's app data folder), where
+# export and search read it
+TRANSCRIPT_WINDOW_LINES = int(os.environ.get("TRANSCRIPT_WINDOW_LINES", 500))
+TRANSCRIPT_DIR = os.environ.get("TRANSCRIPT_DIR") or None
 
 
 def resource_path(relative_path):
@@ -24,74 +38,129 @@ def resource_path(relative_path):
     else:
         return os.path.join(os.path.abspath("."), relative_path)
 
-class WebSocketThread(QThread):
-    update_transcription = pyqtSignal(str)
+def transcript_dir():
+    """TRANSCRIPT_DIR, or a folder in the per-user data directory; the bundled app runs with cwd "/"."""
+    if TRANSCRIPT_DIR:
+        return TRANSCRIPT_DIR
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "transcripts")
+
+
+class TranscriptModel(QAbstractListModel):
+    """The most recent `max_lines` final segments plus the partial of the utterance in progress.
+
+    Shown in a QListView, which only lays out the rows in view; older segments
+    are dropped from memory here and live on in the journal.
+    """
 
-    def __init__(self, uri, audio_queue, parent=None):
+    def __init__(self, max_lines, parent=None):
         super().__init__(parent)
-        self.uri = uri
-        self.is_streaming = False
-        self.audio_queue = audio_queue
-        self.websocket = None
-        self.loop = None
+        self.lines = deque()
+        self.max_lines = max_lines
+        self.partial = ""
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.lines) + bool(self.partial)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.lines[index.row()] if index.row() < len(self.lines) else self.partial
+        if role == Qt.ForegroundRole and index.row() == len(self.lines):
+            return QColor(Qt.gray)  # Partial text may still change
+        return None
+
+    def append(self, text):
+        self.set_partial("")
+        if len(self.lines) >= self.max_lines:
+            self.beginRemoveRows(QModelIndex(), 0, 0)
+            self.lines.popleft()
+            self.endRemoveRows()
+        self.beginInsertRows(QModelIndex(), len(self.lines), len(self.lines))
+        self.lines.append(text)
+        self.endInsertRows()
+
+    def set_partial(self, text):
+        row = len(self.lines)
+        if text and self.partial:
+            self.partial = text
+            self.dataChanged.emit(self.index(row), self.index(row))
+        elif text:
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.partial = text
+            self.endInsertRows()
+        elif self.partial:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            self.partial = ""
+            self.endRemoveRows()
+
+
+class JournalThread(QThread):
+    """Runs a search or export of the journal, which flushes and reads the whole file, off the GUI thread."""
+    result = pyqtSignal(object)  # The function's return value, or the exception it raised
+
+    def __init__(self, function, *args, parent=None):
+        super().__init__(parent)
+        self.function = function
+        self.args = args
 
     def run(self):
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
         try:
-            self.loop.run_until_complete(self.stream_audio())
-        finally:
-            self.loop.close()
+            self.result.emit(self.function(*self.args))
+        except Exception as e:
+            self.result.emit(e)
+
 
-    async def stream_audio(self):
+class WebSocketThread(QThread):
+    """Runs a StreamClient on its own event loop and turns server messages into Qt signals."""
+    update_transcription = pyqtSignal(str, object)  # Text and its audio_end, when the server sent one
+    update_partial = pyqtSignal(str)
+    update_status = pyqtSignal(str)
+
+    def __init__(self, uri, capture, chunk_samples, fs=16000, language="de", task="translate", target_lang="EN-GB",
+                 codecs=("pcm16",), parent=None):
+        super().__init__(parent)
+        self.client = StreamClient(uri, capture, chunk_samples, fs=fs, language=language, task=task,
+                                   target_lang=target_lang, codecs=codecs, on_message=self.handle_message)
+
+    def run(self):
         try:
-            print(f"Connecting to WebSocket server: {self.uri}")
-            async with websockets.connect(self.uri) as websocket:
-                self.websocket = websocket
-                print(f"Connected to WebSocket server: {self.uri}")
-                self.is_streaming = True
-
-                send_task = asyncio.ensure_future(self.send_audio(websocket))
-                recv_task = asyncio.ensure_future(self.receive_transcription(websocket))
-                await asyncio.gather(send_task, recv_task)
+            asyncio.run(self.client.run())
         except Exception as e:
             print(f"Error during WebSocket connection: {e}")
 
-    async def send_audio(self, websocket):
-        while self.is_streaming:
-            if not self.audio_queue.empty():
-                audio_chunk = self.audio_queue.get()
-                print(f"Sending audio chunk of size: {len(audio_chunk)}")
-                await websocket.send(audio_chunk)
-            else:
-                await asyncio.sleep(0.1)
-
-    async def receive_transcription(self, websocket):
-        try:
-            while self.is_streaming:
-                transcription_message = await websocket.recv()
-                print(f"Received transcription: {transcription_message}")
-                
-                # Parse the JSON message to extract the transcription text
-                try:
-                    transcription_dict = json.loads(transcription_message)
-                    transcription_text = transcription_dict.get("transcription", "")
-                    if transcription_text:
-                        # Emit the transcription text (without JSON formatting) to update the UI
-                        self.update_transcription.emit(transcription_text)
-                    else:
-                        print("No transcription found in the message.")
-                except json.JSONDecodeError:
-                    print(f"Failed to parse transcription message: {transcription_message}")
-        except websockets.ConnectionClosed:
-            print("WebSocket connection closed")
+    def handle_message(self, transcription_dict):
+        """Called on the client's event loop; signals are queued to the GUI thread."""
+        print(f"Received transcription: {transcription_dict}")
+        transcription_text = transcription_dict.get("transcription", "")
+        message_type = transcription_dict.get("type")
+        if message_type == "config":
+            pass  # The server's echo of the session config
+        elif message_type == "language":
+            print(f"Detected language: {transcription_dict.get('language')}")
+        elif message_type == "error":
+            print(f"Server rejected the session: {transcription_dict.get('message')}")
+        elif message_type == "status":
+            # The server fell behind real time and merges or skips audio until it catches up
+            self.update_status.emit(transcription_dict.get("mode", "live"))
+        elif message_type == "gap":
+            print(f"Server missed {transcription_dict['missing_frames']} audio frames")
+        elif message_type == "skipped":
+            print(f"Server skipped audio from {transcription_dict['audio_start']:.1f}s "
+                  f"to {transcription_dict['audio_end']:.1f}s to catch up")
+        elif message_type == "partial":
+            # Unstable text for the utterance in progress, replaces the previous partial
+            self.update_partial.emit(transcription_text)
+        elif transcription_text:
+            # Emit the transcription text (without JSON formatting) to update the UI
+            self.update_transcription.emit(transcription_text, transcription_dict.get("audio_end"))
+        else:
+            print("No transcription found in the message.")
+            self.update_partial.emit("")  # The pending partial turned out to be nothing
 
     def stop(self):
         print("Stopping WebSocket thread...")
-        self.is_streaming = False
-        if self.websocket and not self.websocket.closed:
-            asyncio.run_coroutine_threadsafe(self.websocket.close(), self.loop)
-
+        self.client.stop()
 
 
 class WAVStreamerApp(QWidget):
@@ -99,13 +168,13 @@ class WAVStreamerApp(QWidget):
         super().__init__()
         self.initUI()
         self.fs = 16000  # Sample rate (16 kHz for WAV format)
-        self.chunk_duration = 1  # Send audio in 1-second chunks
-        self.buffer = bytearray()  # Buffer to accumulate audio data
-        self.chunk_size = self.fs * 2 * 1  # 1 second of audio
-        self.audio_queue = Queue()  # Queue for streaming audio data
+        self.chunk_samples = self.fs * STREAM_CHUNK_MS // 1000  # Samples per WebSocket frame
+        self.capture = CaptureRingBuffer(self.fs * STREAM_BUFFER_S)  # Bounded, drops the oldest audio
         self.websocket_thread = None
+        self.journal = None  # TranscriptJournal of the current or last session
+        self.journal_threads = set()  # Searches and exports still running
         self.is_recording = False
-        self.audio_stream = None
+        self.microphone = None  # MicrophoneSource feeding the capture ring
 
     def initUI(self):
         # Set window properties
@@ -145,11 +214,25 @@ class WAVStreamerApp(QWidget):
         # Connect the button click to toggle_recording method
         self.record_button.clicked.connect(self.toggle_recording)
 
-        # Add a QTextEdit for displaying live transcriptions
-        self.transcription_area = QTextEdit(self)
-        self.transcription_area.setReadOnly(True)  # Make the text area read-only
+        # Live transcriptions, in a list view that only lays out the visible rows
+        self.transcript = TranscriptModel(TRANSCRIPT_WINDOW_LINES, self)
+        self.transcription_area = QListView(self)
+        self.transcription_area.setModel(self.transcript)
+        self.transcription_area.setWordWrap(True)
+        self.transcription_area.setSelectionMode(QListView.ExtendedSelection)
         layout.addWidget(self.transcription_area)
 
+        # Search and export work on the full transcript in the journal
+        tools = QHBoxLayout()
+        self.search_field = QLineEdit(self)
+        self.search_field.setPlaceholderText("Search transcript...")
+        self.search_field.returnPressed.connect(self.search_transcript)
+        tools.addWidget(self.search_field)
+        self.export_button = QPushButton("Export", self)
+        self.export_button.clicked.connect(self.export_transcript)
+        tools.addWidget(self.export_button)
+        layout.addLayout(tools)
+
         # Set the layout to the main window
         self.setLayout(layout)
 
@@ -165,52 +248,115 @@ class WAVStreamerApp(QWidget):
         """Start microphone recording and WebSocket streaming."""
         self.label.setText("Streaming... Click again to stop.")
         self.is_recording = True
-
-        # Set up the audio stream
-        self.audio_stream = sd.InputStream(samplerate=self.fs, channels=1, dtype='int16',
-                                           callback=self.audio_callback)
-        self.audio_stream.start()
+        self.capture = CaptureRingBuffer(self.fs * STREAM_BUFFER_S)
+        if self.journal:
+            self.journal.close()
+        self.journal = TranscriptJournal(os.path.join(transcript_dir(), time.strftime("transcript-%Y%m%d-%H%M%S.jsonl")))
 
         # Start WebSocket thread for streaming audio data
-        self.websocket_thread = WebSocketThread(f"ws://{TRANSCRIPTION_ENDPOINT.replace("http://", "")}", self.audio_queue)
+        self.websocket_thread = WebSocketThread(f"ws://{TRANSCRIPTION_ENDPOINT.replace('http://', '')}",
+                                                self.capture, self.chunk_samples, fs=self.fs, language=STREAM_LANGUAGE,
+                                                task=STREAM_TASK, target_lang=STREAM_TARGET_LANG or None,
+                                                codecs=STREAM_CODECS.split(","))
         self.websocket_thread.update_transcription.connect(self.update_transcription_area)  # Connect signal
+        self.websocket_thread.update_partial.connect(self.update_partial_area)
+        self.websocket_thread.update_status.connect(self.update_server_status)
         self.websocket_thread.start()
 
+        # Set up the audio stream
+        self.microphone = MicrophoneSource(self.websocket_thread.client, self.fs)
+        self.microphone.start()
+
     def stop_streaming(self):
         """Stops WebSocket streaming and closes audio stream."""
         self.label.setText("Streaming stopped.")
         self.is_recording = False
 
-        if self.audio_stream:
-            self.audio_stream.stop()
+        if self.microphone:
+            self.microphone.stop()
 
         if self.websocket_thread:
             self.websocket_thread.stop()
             self.websocket_thread.wait()
 
-    def audio_callback(self, indata, frames, time, status):
-        """Callback for capturing audio in real-time."""
-        if status:
-            print(f"Audio stream status: {status}")
-    
-        max_amplitude = np.max(np.abs(indata))
-        print(f"Audio callback received {frames} frames. Max amplitude: {max_amplitude}")
-        
-        self.buffer.extend(indata.tobytes())
-
-        if len(self.buffer) >= self.chunk_size:
-            print(f"Queuing audio chunk of size: {len(self.buffer)}")
-            self.audio_queue.put(self.buffer)
-            self.buffer = bytearray()  # Clear buffer after sending
+    def update_transcription_area(self, transcription, audio_end=None):
+        """Show a final segment and journal it."""
+        follow = self.at_bottom()
+        self.transcript.append(transcription)
+        self.journal.append(transcription, audio_end)
+        if follow:
+            self.transcription_area.scrollToBottom()
+
+    def update_partial_area(self, transcription):
+        """Replace the partial transcription of the current utterance in place."""
+        follow = self.at_bottom()
+        self.transcript.set_partial(transcription)
+        if follow:
+            self.transcription_area.scrollToBottom()
+
+    def at_bottom(self):
+        """Whether the view shows the newest line; it only follows new text if so, like a terminal."""
+        scrollbar = self.transcription_area.verticalScrollBar()
+        return scrollbar.value() == scrollbar.maximum()
+
+    def update_server_status(self, mode):
+        """Show whether the server keeps up with real time."""
+        if mode == "catchup":
+            self.label.setText("Streaming... Server is catching up, captions are delayed.")
+        else:
+            self.label.setText("Streaming... Click again to stop.")
+
+    def search_transcript(self):
+        """Lists the journaled segments that contain the search text."""
+        query = self.search_field.text().strip()
+        if not query or not self.journal:
+            return
+        self.run_journal_task(lambda matches: self.show_matches(query, matches), self.journal.search, query)
+
+    def show_matches(self, query, matches):
+        text = "\n".join(format_entry(entry) for entry in matches) or "No matches."
+        QMessageBox.information(self, f"Search: {query}", text)
+
+    def export_transcript(self):
+        """Saves the full transcript of the session as timestamped text."""
+        if not self.journal:
+            QMessageBox.information(self, "Export", "Nothing to export yet.")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export transcript", "transcript.txt", "Text files (*.txt)")
+        if path:
+            self.run_journal_task(lambda _: self.label.setText(f"Transcript exported to {path}"), self.journal.export, path)
+
+    def run_journal_task(self, on_result, function, *args):
+        """Runs `function(*args)` in a JournalThread and hands its result to `on_result` on the GUI thread."""
+        thread = JournalThread(function, *args)
+        self.journal_threads.add(thread)
+        thread.finished.connect(lambda: self.journal_threads.discard(thread))
+        thread.result.connect(lambda result: self.journal_task_done(on_result, result))
+        thread.start()
+
+    def journal_task_done(self, on_result, result):
+        if isinstance(result, Exception):
+            QMessageBox.warning(self, "Transcript", f"Reading the transcript failed: {result}")
+        else:
+            on_result(result)
 
-    def update_transcription_area(self, transcription):
-        """Display transcription results in the text area."""
-        self.transcription_area.append(transcription)
+    def closeEvent(self, event):
+        """Stops the stream and writes the journal's last entries before the window closes."""
+        if self.is_recording:
+            self.stop_streaming()
+        for thread in list(self.journal_threads):
+            thread.wait()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        super().closeEvent(event)
 
 
 # Main function to run the app
 def main():
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
     app = QApplication(sys.argv)
+    app.setApplicationName("TransApp")  # Names the app data folder the transcripts go to
     uploader = WAVStreamerApp()
     uploader.show()
     sys.exit(app.exec_())
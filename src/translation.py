@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class DeepLBackend:
+    """Translates through the DeepL API; one request per batch of texts."""
+
+    def __init__(self, api_key):
+        import deepl  # Only needed when DeepL is actually used
+        self.translator = deepl.Translator(api_key)
+
+    def translate(self, texts, target_lang, source_lang=None):
+        results = self.translator.translate_text(texts, source_lang=source_lang, target_lang=target_lang)
+        return [result.text for result in results]
+
+
+class FakeBackend:
+    """Offline stand-in for DeepL that tags each text with its target language."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency  # Simulated round-trip time in seconds
+        self.requests = 0
+
+    def translate(self, texts, target_lang, source_lang=None):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [f"[{target_lang}] {text}" for text in texts]
+
+
+def create_backend(name=None):
+    """Builds the backend named by `name` or the TRANSLATOR_BACKEND env variable."""
+    name = name or os.environ.get("TRANSLATOR_BACKEND", "deepl")
+    if name == "deepl":
+        return DeepLBackend(os.environ.get("DEEPL_API_KEY", None))
+    if name == "fake":
+        return FakeBackend(latency=float(os.environ.get("FAKE_TRANSLATOR_LATENCY_MS", 0)) / 1000)
+    raise ValueError(f"Unknown translator backend: {name}")
+
+
+class TranslationCache:
+    """Thread-safe LRU cache with a per-entry time to live."""
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl  # Seconds an entry stays valid
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class Translator:
+    """Caching, micro-batching async translation layer in front of a backend.
+
+    `translate` answers repeated phrases from the cache. Misses are queued and
+    sent to the backend in batches of up to `max_batch_size` texts, closed after
+    `max_wait` seconds, with identical pending texts sharing one slot. Backend
+    calls run in threads so the event loop is never held up; `run()` must be
+    started as a background task before `translate` is awaited.
+    """
+
+    def __init__(self, backend, cache_size=1024, cache_ttl=3600, max_batch_size=16, max_wait=0.02, max_concurrency=4):
+        self.backend = backend
+        self.cache = TranslationCache(cache_size, cache_ttl)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self._pending = {}  # Cache key -> future shared by every caller waiting on it
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+
+    async def translate(self, text, target_lang="EN-GB", source_lang=None):
+        key = (text, source_lang, target_lang)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            await self.queue.put(key)
+        return await asyncio.shield(future)  # A cancelled caller must not cancel other waiters
+
+    def translate_blocking(self, text, target_lang="EN-GB", source_lang=None):
+        """Cached, unbatched translation for callers outside an event loop."""
+        key = (text, source_lang, target_lang)
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self.backend.translate([text], target_lang, source_lang)[0]
+            self.cache.put(key, cached)
+        return cached
+
+    async def run(self):
+        """Batches queued texts forever; run it as a background task."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            # One backend request per language pair
+            groups = {}
+            for key in batch:
+                groups.setdefault(key[1:], []).append(key)
+            for (source_lang, target_lang), keys in groups.items():
+                await self._run_group(keys, source_lang, target_lang)
+        finally:
+            self._slots.release()
+
+    async def _run_group(self, keys, source_lang, target_lang):
+        try:
+            texts = await asyncio.to_thread(self.backend.translate, [key[0] for key in keys], target_lang, source_lang)
+        except Exception as e:
+            log.error("Translation failed: %s", e)
+            for key in keys:
+                future = self._pending.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, text in zip(keys, texts):
+            self.cache.put(key, text)
+            future = self._pending.pop(key)
+            if not future.done():
+                future.set_result(text)
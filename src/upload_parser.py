@@ -0,0 +1,133 @@
+import io
+from email.message import Message
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Malformed or oversized upload; the message is safe to return to the client."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def header_param(value, param):
+    """Extracts a parameter such as `boundary` or `filename` from a MIME header value."""
+    message = Message()
+    message['content-type'] = value
+    return message.get_param(param)
+
+
+class BodyReader:
+    """Reads a request body in chunks, whether it has a Content-Length or is chunked."""
+
+    def __init__(self, rfile, headers, max_size):
+        self.rfile = rfile
+        self.max_size = max_size
+        self.chunked = headers.get('Transfer-Encoding', '').lower() == 'chunked'
+        self.remaining = 0 if self.chunked else int(headers.get('Content-Length') or 0)
+        if self.remaining > max_size:
+            raise UploadError("Upload too large.", status=413)
+        self.size = 0
+        self._done = False
+
+    def read(self, size=CHUNK_SIZE):
+        """Returns up to `size` bytes, or b"" at the end of the body."""
+        if self._done:
+            return b""
+        if self.chunked:
+            data = self._read_chunk(size)
+        else:
+            data = self.rfile.read(min(size, self.remaining)) if self.remaining else b""
+            self.remaining -= len(data)
+            if self.remaining and not data:
+                raise UploadError("Request body ended early.")
+        if not data:
+            self._done = True
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadError("Upload too large.", status=413)
+        return data
+
+    def _read_chunk(self, size):
+        if self.remaining == 0:
+            line = self.rfile.readline(1024)
+            try:
+                self.remaining = int(line.split(b';')[0], 16)
+            except ValueError:
+                raise UploadError("Malformed chunked encoding.")
+            if self.remaining == 0:
+                while self.rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+                    pass  # Skip trailers
+                return b""
+        data = self.rfile.read(min(size, self.remaining))
+        if not data:
+            raise UploadError("Request body ended early.")
+        self.remaining -= len(data)
+        if self.remaining == 0:
+            self.rfile.readline(1024)  # CRLF after the chunk data
+        return data
+
+
+def read_multipart_file(body, boundary, field='file'):
+    """Streams a multipart/form-data body and returns (filename, data) of the `field` part.
+
+    The body is consumed in fixed-size chunks and the file content is copied
+    into an in-memory buffer as it arrives, so the upload is never held twice
+    and never written to disk.
+    """
+    delimiter = b"\r\n--" + boundary.encode()
+    buffer = bytearray(b"\r\n")  # Lets the first delimiter match like the others
+    result = None
+
+    def fill():
+        data = body.read()
+        buffer.extend(data)
+        return bool(data)
+
+    # Skip the preamble
+    while (index := buffer.find(delimiter)) < 0:
+        del buffer[:max(0, len(buffer) - len(delimiter))]
+        if not fill():
+            raise UploadError("Malformed multipart body.")
+    del buffer[:index + len(delimiter)]
+
+    while True:
+        while len(buffer) < 2 and fill():
+            pass
+        if buffer[:2] == b"--":
+            break  # Closing delimiter
+
+        # Part headers
+        while (end := buffer.find(b"\r\n\r\n")) < 0:
+            if len(buffer) > CHUNK_SIZE or not fill():
+                raise UploadError("Malformed multipart headers.")
+        headers = {}
+        for line in bytes(buffer[:end]).decode('utf-8', 'replace').split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        del buffer[:end + 4]
+        disposition = headers.get('content-disposition', '')
+        wanted = result is None and header_param(disposition, 'name') == field
+        data = io.BytesIO() if wanted else None
+
+        # Part body, streamed up to the next delimiter
+        while (index := buffer.find(delimiter)) < 0:
+            keep = len(delimiter) - 1  # A delimiter may straddle two chunks
+            if data is not None and len(buffer) > keep:
+                data.write(buffer[:-keep])
+            del buffer[:max(0, len(buffer) - keep)]
+            if not fill():
+                raise UploadError("Malformed multipart body.")
+        if data is not None:
+            data.write(buffer[:index])
+            result = (header_param(disposition, 'filename'), data.getvalue())
+        del buffer[:index + len(delimiter)]
+
+    # Drain whatever follows the closing delimiter so the connection stays usable
+    while body.read():
+        pass
+    if result is None or not result[0]:
+        raise UploadError("Missing file in request.")
+    return result
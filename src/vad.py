@@ -0,0 +1,178 @@
+from collections import deque
+import numpy as np
+from audio_buffer import AudioRingBuffer
+
+
+class VoiceActivityDetector:
+    """Vectorized energy / zero-crossing voice activity detector for 16-bit mono PCM.
+
+    Audio is cut into fixed frames and a frame counts as speech when its RMS
+    level is clearly above the running noise floor and its zero-crossing rate
+    is below that of broadband noise. Very loud frames count as speech
+    regardless of their zero-crossing rate so fricatives are not clipped.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=30, energy_threshold=0.01, noise_ratio=3.0, zcr_threshold=0.35):
+        self.frame_length = sample_rate * frame_ms // 1000
+        self.energy_threshold = energy_threshold  # Minimum RMS (full scale = 1.0) for speech
+        self.noise_ratio = noise_ratio  # Speech must be this many times louder than the noise floor
+        self.zcr_threshold = zcr_threshold  # Zero crossings per sample above which a quiet frame is noise
+        self.noise_floor = energy_threshold / noise_ratio
+
+    def detect(self, samples):
+        """Classifies every complete frame of an int16 array, returning one bool per frame."""
+        n_frames = len(samples) // self.frame_length
+        if n_frames == 0:
+            return np.zeros(0, dtype=bool)
+        frames = samples[:n_frames * self.frame_length].reshape(n_frames, self.frame_length)
+
+        scaled = frames.astype(np.float32) / 32768
+        rms = np.sqrt(np.mean(scaled * scaled, axis=1))
+        zcr = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1) / self.frame_length
+
+        threshold = max(self.energy_threshold, self.noise_floor * self.noise_ratio)
+        speech = (rms > threshold) & ((zcr < self.zcr_threshold) | (rms > threshold * 4))
+
+        # Let the noise floor track the level of the frames we just called silence
+        if not speech.all():
+            self.noise_floor = 0.9 * self.noise_floor + 0.1 * float(np.median(rms[~speech]))
+        return speech
+
+
+class _FrameStream:
+    """Splits arbitrary-sized int16 chunks into VAD frames, carrying the remainder over."""
+
+    def __init__(self, vad):
+        self.vad = vad
+        self._remainder = np.zeros(0, dtype=np.int16)
+        self._pending = b""  # Odd trailing byte of a chunk split mid-sample
+
+    def frames(self, data):
+        if not isinstance(data, np.ndarray):
+            if self._pending:
+                data = self._pending + bytes(data)
+                self._pending = b""
+            if len(data) % 2:
+                self._pending = bytes(data[-1:])
+                data = data[:-1]
+            data = np.frombuffer(data, dtype=np.int16)
+        samples = np.concatenate((self._remainder, data.reshape(-1))) if len(self._remainder) else data.reshape(-1)
+        speech = self.vad.detect(samples)
+        used = len(speech) * self.vad.frame_length
+        self._remainder = samples[used:].copy()
+        return zip(samples[:used].reshape(-1, self.vad.frame_length), speech)
+
+
+class SpeechSegmenter:
+    """Turns a continuous stream into speech segments that close at pauses.
+
+    Silence is never buffered beyond a short pre-roll, a segment closes once
+    `min_silence_ms` of silence follows speech, and no segment grows longer
+    than `max_segment_s`. Segments with less than `min_speech_ms` of speech
+    (clicks, coughs) are discarded.
+    """
+
+    def __init__(self, vad, sample_rate=16000, max_segment_s=15, min_silence_ms=500, pre_roll_ms=200, min_speech_ms=150):
+        frame_ms = 1000 * vad.frame_length / sample_rate
+        self.vad = vad
+        self.max_samples = int(max_segment_s * sample_rate)
+        self.min_silence_frames = max(1, round(min_silence_ms / frame_ms))
+        self.min_speech_frames = max(1, round(min_speech_ms / frame_ms))
+        self._frames = _FrameStream(vad)
+        self._pre_roll = deque(maxlen=round(pre_roll_ms / frame_ms))
+        self._segment = AudioRingBuffer(self.max_samples)
+        self._in_speech = False
+        self._silent_frames = 0
+        self._speech_frames = 0
+
+    def push(self, data):
+        """Feeds 16-bit PCM bytes (or int16 samples) and returns the float32 segments that closed."""
+        segments = []
+        for frame, voiced in self._frames.frames(data):
+            if not self._in_speech:
+                if not voiced:
+                    self._pre_roll.append(frame.copy())  # Frames are views of the caller's buffer
+                    continue
+                self._in_speech = True
+                for pre_frame in self._pre_roll:
+                    self._segment.write(pre_frame)
+                self._pre_roll.clear()
+
+            self._segment.write(frame)
+            if voiced:
+                self._speech_frames += 1
+                self._silent_frames = 0
+            else:
+                self._silent_frames += 1
+
+            if self._silent_frames >= self.min_silence_frames:
+                self._close(segments)
+                self._in_speech = False
+            elif len(self._segment) + self.vad.frame_length > self.max_samples:
+                self._close(segments)  # Hit the length cap mid-utterance, keep listening
+        return segments
+
+    def __len__(self):
+        """Number of samples in the open segment."""
+        return len(self._segment)
+
+    def peek(self):
+        """Returns a float32 copy of the open segment without closing it."""
+        return self._segment.peek().copy()
+
+    def discard(self, n):
+        """Drops the first `n` samples of the open segment, e.g. once they are transcribed."""
+        self._segment.discard(n)
+
+    def flush(self):
+        """Closes the open segment, if any, at the end of the stream."""
+        segments = []
+        if self._in_speech:
+            self._close(segments)
+            self._in_speech = False
+        return segments
+
+    def _close(self, segments):
+        if self._speech_frames >= self.min_speech_frames:
+            segments.append(self._segment.read().copy())  # The ring's float view is reused
+        else:
+            self._segment.clear()
+        self._silent_frames = 0
+        self._speech_frames = 0
+
+
+class SpeechGate:
+    """Client-side gate that only lets speech (plus some context) through.
+
+    Voiced frames open the gate together with a short pre-roll, and the gate
+    stays open for `hangover_ms` after speech stops so the server still sees
+    the pause that ends the utterance.
+    """
+
+    def __init__(self, vad, sample_rate=16000, pre_roll_ms=200, hangover_ms=700):
+        frame_ms = 1000 * vad.frame_length / sample_rate
+        self.hangover_frames = max(1, round(hangover_ms / frame_ms))
+        self._frames = _FrameStream(vad)
+        self._pre_roll = deque(maxlen=round(pre_roll_ms / frame_ms))
+        self._remaining = 0  # Frames left before the gate closes
+        self.is_open = False
+
+    def process(self, data):
+        """Returns the int16 samples of `data` that should be sent on."""
+        passed = []
+        for frame, voiced in self._frames.frames(data):
+            if voiced:
+                if not self.is_open:
+                    passed.extend(self._pre_roll)
+                    self._pre_roll.clear()
+                    self.is_open = True
+                self._remaining = self.hangover_frames
+            if self.is_open:
+                passed.append(frame)
+                self._remaining -= 1
+                self.is_open = self._remaining > 0
+            else:
+                self._pre_roll.append(frame.copy())  # Frames are views of the caller's buffer
+        if not passed:
+            return np.zeros(0, dtype=np.int16)
+        return np.concatenate(passed)
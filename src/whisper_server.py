@@ -1,70 +1,246 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import cgi
-import torch
-import whisper
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import threading
 import json
+import logging
 import os
-import deepl
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
+from audio_decode import DecodeError, FfmpegPool, decode_audio
+from inference import ProcessPoolBackend, ThreadBackend, load_model
+from metrics import REGISTRY, Counter, Gauge, bearer_matches, timed, tracer
+from session_config import SessionConfig
+from translation import Translator, create_backend
+from upload_parser import BodyReader, UploadError, header_param, read_multipart_file
 load_dotenv()
 
-DEEPL_API_KEY = os.environ.get("DEEPL_API_KEY", None)
-translator = deepl.Translator(DEEPL_API_KEY)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+log = logging.getLogger("whisper_server")
+
+# Translation layer (DeepL by default, TRANSLATOR_BACKEND=fake for offline runs)
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", 1024))
+TRANSLATION_CACHE_TTL_S = int(os.environ.get("TRANSLATION_CACHE_TTL_S", 3600))
+translator = None  # Created in main(), so spawned inference workers never build a DeepL client
+
+# Whisper model and inference backend. INFERENCE_WORKERS is the number of uploads
+# transcribed at once; with 0 a single in-process model handles them one by one.
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "turbo")
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", 0)) or None  # Torch threads per worker
+WHISPER_DEVICE = os.environ.get("WHISPER_DEVICE") or None  # cuda or cpu; CUDA when available by default
+WHISPER_PRECISION = os.environ.get("WHISPER_PRECISION", "fp32")  # int8 quantizes the model for CPU inference
+
+PORT = int(os.environ.get("PORT", 42331))
+
+# Uploads beyond the running ones wait in a queue of UPLOAD_QUEUE_SIZE; past that the
+# server answers 503 with a Retry-After of UPLOAD_RETRY_AFTER_S
+UPLOAD_QUEUE_SIZE = int(os.environ.get("UPLOAD_QUEUE_SIZE", 8))
+UPLOAD_RETRY_AFTER_S = int(os.environ.get("UPLOAD_RETRY_AFTER_S", 10))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", 200)) * 1024 * 1024
+# ffmpeg processes kept started for non-WAV uploads; 0 spawns one per upload
+FFMPEG_POOL_SIZE = int(os.environ.get("FFMPEG_POOL_SIZE", 2))
+
+backend = None  # Created in main()
+loop = None  # Event loop thread the request threads hand inference to
+admission = None
+ffmpeg_pool = None
+ready = threading.Event()  # Set once the model is loaded
+
+# Fraction of uploads traced stage by stage to the log. GET /trace?rate=X changes it at runtime
+# for requests with `Authorization: Bearer <TRACE_TOKEN>`; without TRACE_TOKEN it is fixed.
+tracer.sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+TRACE_TOKEN = os.environ.get("TRACE_TOKEN") or None
+
+# Metrics served on GET /metrics
+UPLOADS = Counter("transapp_uploads_total", "Uploads by response status.", labels=("status",))
+UPLOAD_BYTES = Counter("transapp_upload_bytes_total", "Audio file bytes received.")
+Gauge("transapp_uploads_in_flight", "Uploads running or queued for a replica.",
+      function=lambda: admission.in_flight if admission else 0)
+
+
+class AdmissionLimiter:
+    """Counts uploads in flight (running or queued) and refuses them past a limit."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
 
-# Load Whisper model on GPU (use GPU 3 if available)
-#device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-#model = whisper.load_model("turbo", device=device)
-model = whisper.load_model("turbo")
 
 class TranscriptionHandler(BaseHTTPRequestHandler):
 
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/healthz':
+            # Liveness: the process is up and serving requests
+            self.send_json(200, {"status": "ok"})
+        elif url.path == '/readyz':
+            # Readiness: the model is loaded and there is room for another upload
+            status = {"in_flight": admission.in_flight, "limit": admission.limit}
+            if ready.is_set() and admission.in_flight < admission.limit:
+                self.send_json(200, dict(status, status="ready"))
+            else:
+                self.send_json(503, dict(status, status="loading" if not ready.is_set() else "busy"))
+        elif url.path == '/metrics':
+            self.send_body(200, 'text/plain; version=0.0.4', REGISTRY.render().encode())
+        elif url.path == '/trace':
+            rate = parse_qs(url.query).get('rate')
+            if rate:
+                if not bearer_matches(self.headers.get('Authorization'), TRACE_TOKEN):
+                    self.send_json(403, {"error": "changing the rate needs the TRACE_TOKEN bearer token"})
+                    return
+                try:
+                    tracer.sample_rate = min(1.0, max(0.0, float(rate[0])))
+                except ValueError:
+                    self.send_json(400, {"error": "rate must be a number between 0 and 1"})
+                    return
+                log.info("Trace sample rate set to %s", tracer.sample_rate)
+            self.send_json(200, {"rate": tracer.sample_rate})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
     def do_POST(self):
         # Only accept POST requests with multipart/form-data
-        if 'multipart/form-data' in self.headers['Content-Type']:
-            try:
-                # Parse the multipart form-data to get the uploaded file
-                form = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ={'REQUEST_METHOD': 'POST'})
-                file_field = form['file']  # Assuming the file field is named 'file'
-
-                if file_field.filename:
-                    # Save the uploaded MP3 file temporarily
-                    file_data = file_field.file.read()
-                    temp_filename = "temp_audio.mp3"
-                    with open(temp_filename, "wb") as f:
-                        f.write(file_data)
-
-                    # Transcribe the audio using Whisper
-                    result = model.transcribe(temp_filename, language='de', task='translate')
-                    transcription = result['text']
-
-                    # Clean up the temp file
-                    os.remove(temp_filename)
-
-                    # Respond with the transcription
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    translation = translator.translate_text(transcription, target_lang="EN-GB")
-                    response = {"transcription": translation.text}
-                    self.wfile.write(json.dumps(response).encode())
-                else:
-                    # File field was missing or empty
-                    self.send_response(400)
-                    self.end_headers()
-                    self.wfile.write(b"Missing file in request.")
-            except Exception as e:
-                # Handle unexpected errors
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(f"Internal Server Error: {str(e)}".encode())
-        else:
+        content_type = self.headers.get('Content-Type', '')
+        if 'multipart/form-data' not in content_type:
             # If the request doesn't contain multipart/form-data, return 400
             self.send_response(400)
             self.end_headers()
             self.wfile.write(b"Invalid content-type. Expected multipart/form-data.")
+            UPLOADS.inc(status=400)
+            return
+
+        # Optional ?language=auto&task=transcribe&target_lang=FR; "auto" lets Whisper detect the language
+        # and an empty target_lang skips translation, as in the streaming config
+        try:
+            query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query, keep_blank_values=True).items()
+                     if values[0] or name == "target_lang"}
+            config = SessionConfig.from_dict(query)
+        except ValueError as e:
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(str(e).encode())
+            UPLOADS.inc(status=400)
+            return
+
+        trace = tracer.start("upload")
+        status = 500
+        admitted = False
+        try:
+            # Stream the multipart body straight into memory, no temp file
+            with timed("upload", trace):
+                body = BodyReader(self.rfile, self.headers, MAX_UPLOAD_BYTES)
+                boundary = header_param(content_type, 'boundary')
+                if not boundary:
+                    raise UploadError("Missing multipart boundary.")
+                _, file_data = read_multipart_file(body, boundary)
+            UPLOAD_BYTES.inc(len(file_data))
+
+            # Admission only once the body is in: the apps upload a recording while it is made,
+            # which would otherwise hold a slot for as long as the speaker talks
+            if not admission.try_acquire():
+                # Saturated: tell the client when to come back instead of queueing without bound
+                status = 503
+                self.send_response(503)
+                self.send_header('Retry-After', str(UPLOAD_RETRY_AFTER_S))
+                self.end_headers()
+                self.wfile.write(b"Server busy, retry later.")
+                return
+            admitted = True
+            with timed("decode", trace):
+                audio = decode_audio(file_data, pool=ffmpeg_pool)
+
+            # Transcribe the audio using Whisper, waiting for a free replica
+            with timed("inference", trace):
+                future = asyncio.run_coroutine_threadsafe(backend.transcribe_long(audio, config.source_language, config.task), loop)
+                transcription = future.result()
+
+            # Respond with the transcription
+            translation = transcription
+            if config.target_lang:
+                with timed("translation", trace):
+                    translation = translator.translate_blocking(transcription, target_lang=config.target_lang)
+            with timed("send", trace):
+                self.send_json(200, {"transcription": translation})
+            status = 200
+        except UploadError as e:
+            status = e.status
+            self.send_response(e.status)
+            self.end_headers()
+            self.wfile.write(str(e).encode())
+        except DecodeError as e:
+            status = 400
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(str(e).encode())
+        except Exception as e:
+            # Handle unexpected errors
+            log.exception("Upload failed: %s", e)
+            self.send_response(500)
+            self.end_headers()
+            self.wfile.write(f"Internal Server Error: {str(e)}".encode())
+        finally:
+            if admitted:
+                admission.release()
+            UPLOADS.inc(status=status)
+            if trace is not None:
+                trace.record["status"] = status
+                trace.finish()
+
+    def send_json(self, status, payload):
+        self.send_body(status, 'application/json', json.dumps(payload).encode())
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)  # Access log only at LOG_LEVEL=DEBUG
+
+
+def on_warm_up(future):
+    if future.exception():
+        log.error("Failed to start the inference backend: %s", future.exception())
+    else:
+        ready.set()
+
+
+def main():
+    global backend, loop, admission, ffmpeg_pool, translator
+    translator = Translator(create_backend(), cache_size=TRANSLATION_CACHE_SIZE, cache_ttl=TRANSLATION_CACHE_TTL_S)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    if INFERENCE_WORKERS > 0:
+        backend = ProcessPoolBackend(WHISPER_MODEL, workers=INFERENCE_WORKERS, torch_threads=TORCH_THREADS,
+                                     device=WHISPER_DEVICE, precision=WHISPER_PRECISION)
+    else:
+        backend = ThreadBackend(load_model(WHISPER_MODEL, WHISPER_DEVICE, WHISPER_PRECISION, TORCH_THREADS))
+    admission = AdmissionLimiter(backend.concurrency + UPLOAD_QUEUE_SIZE)
+    if FFMPEG_POOL_SIZE > 0:
+        ffmpeg_pool = FfmpegPool(FFMPEG_POOL_SIZE)
+
+    # Set up server; health checks are answered while the workers load
+    server_address = ('0.0.0.0', PORT)
+    httpd = ThreadingHTTPServer(server_address, TranscriptionHandler)
+    asyncio.run_coroutine_threadsafe(backend.warm_up(), loop).add_done_callback(on_warm_up)
+    log.info("Server started at port %d...", PORT)
+    httpd.serve_forever()
+
 
-# Set up server
-server_address = ('0.0.0.0', 42331)
-httpd = HTTPServer(server_address, TranscriptionHandler)
-print("Server started at port 42331...")
-httpd.serve_forever()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
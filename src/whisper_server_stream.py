@@ -1,88 +1,509 @@
 import asyncio
+import itertools
+import logging
 import websockets
-import torch
-import whisper
 import json
 import os
-import wave
-import deepl
+import time
+import numpy as np
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
+from audio_codec import FrameReader
+from inference import InferenceScheduler, ProcessPoolBackend, ThreadBackend, load_model
+from mel_features import IncrementalLogMel
+from metrics import REGISTRY, Counter, Gauge, bearer_matches, observe_stage, timed, tracer
+from partials import HypothesisBuffer
+from session_config import SessionConfig
+from translation import Translator, create_backend
+from vad import SpeechSegmenter, VoiceActivityDetector
 
 load_dotenv()
 
-# Load DeepL API key for translation
-DEEPL_API_KEY = os.environ.get("DEEPL_API_KEY", None)
-translator = deepl.Translator(DEEPL_API_KEY)
+# LOG_LEVEL=DEBUG brings back the per-chunk messages; they are skipped at INFO
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+log = logging.getLogger("whisper_server_stream")
 
-# Load Whisper model on GPU (use GPU 3 if available)
-model = whisper.load_model("turbo")
+# Translation layer (DeepL by default, TRANSLATOR_BACKEND=fake for offline runs)
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", 1024))
+TRANSLATION_CACHE_TTL_S = int(os.environ.get("TRANSLATION_CACHE_TTL_S", 3600))
+translator = None  # Created in main() once the event loop is running
 
-async def transcribe_audio(websocket, path):
-    """Handles WebSocket connection and streams audio data for transcription."""
-    audio_buffer = bytearray()  # Buffer to store audio chunks
+# Whisper model and inference backend. With INFERENCE_WORKERS > 0 each worker
+# process loads its own replica and the server process never loads the model.
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "turbo")
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", 0)) or None  # Torch threads per worker
+WHISPER_DEVICE = os.environ.get("WHISPER_DEVICE") or None  # cuda or cpu; CUDA when available by default
+WHISPER_PRECISION = os.environ.get("WHISPER_PRECISION", "fp32")  # int8 quantizes the model for CPU inference
 
-    try:
-        print(f"New WebSocket connection from {websocket.remote_address}")  # Debug connection info
+# Windows from all connections are batched into one decode pass
+BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", 8))
+BATCH_WAIT_MS = int(os.environ.get("INFERENCE_BATCH_WAIT_MS", 50))
+scheduler = None  # Created in main() once the event loop is running
+
+PORT = int(os.environ.get("PORT", 42331))
+SAMPLE_RATE = 16000
+# Segments close at the first pause of VAD_MIN_SILENCE_MS, or at VAD_MAX_SEGMENT_S of audio
+VAD_MAX_SEGMENT_S = float(os.environ.get("VAD_MAX_SEGMENT_S", 15))
+VAD_MIN_SILENCE_MS = int(os.environ.get("VAD_MIN_SILENCE_MS", 500))
+
+
+# With PARTIAL_INTERVAL_MS > 0 the open segment is re-decoded at that interval and
+# sent as `partial` messages; text that two decodes agree on is sent as `final`
+PARTIAL_INTERVAL_MS = int(os.environ.get("PARTIAL_INTERVAL_MS", 0))
+PARTIAL_SAMPLES = SAMPLE_RATE * PARTIAL_INTERVAL_MS // 1000
+
+# Each session runs as a pipeline of stages; a stage may run this many items ahead of the next
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 16))
+
+# A session whose oldest pending window trails the live audio by more than CATCHUP_LAG_S
+# enters catch-up mode: partials stop, queued segments are merged into fewer decodes and,
+# with CATCHUP_MODEL set, decoded by that smaller model. Audio more than MAX_LAG_S behind
+# is skipped. Past MAX_SESSIONS concurrent sessions new connections get a 503.
+CATCHUP_LAG_S = float(os.environ.get("CATCHUP_LAG_S", 8))
+MAX_LAG_S = float(os.environ.get("MAX_LAG_S", 30))
+CATCHUP_MODEL = os.environ.get("CATCHUP_MODEL") or None
+MERGE_MAX_SAMPLES = 30 * SAMPLE_RATE  # Whisper's window; longer merges would be cut off
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 0))
+SESSION_RETRY_AFTER_S = int(os.environ.get("SESSION_RETRY_AFTER_S", 10))
+catchup_scheduler = None  # Created in main() when CATCHUP_MODEL is set
+
+# Sessions that ask for language "auto" detect it once; LANGUAGE_RECHECK_S > 0 re-detects
+# it after that many seconds of audio, for meetings that switch languages
+LANGUAGE_RECHECK_S = float(os.environ.get("LANGUAGE_RECHECK_S", 0))
+
+# Fraction of segments traced stage by stage to the log. GET /trace?rate=X changes it at runtime
+# for requests with `Authorization: Bearer <TRACE_TOKEN>`; without TRACE_TOKEN it is fixed.
+tracer.sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+TRACE_TOKEN = os.environ.get("TRACE_TOKEN") or None
+
+# Metrics served on GET /metrics next to the WebSocket endpoint
+session_ids = itertools.count(1)
+sessions = set()  # Open StreamSessions
+Gauge("transapp_active_sessions", "Open WebSocket sessions.", function=lambda: len(sessions))
+REJECTED_SESSIONS = Counter("transapp_rejected_sessions_total", "Connections refused at the session cap.")
+LOST_FRAMES = Counter("transapp_lost_audio_frames_total", "Audio frames missing from the sequence.")
+SKIPPED_SECONDS = Counter("transapp_skipped_audio_seconds_total", "Speech skipped because it fell too far behind.")
+SESSION_LAG = Gauge("transapp_session_lag_seconds", "How far the oldest pending window trails live audio.",
+                    labels=("session",))
+SESSION_RTF = Gauge("transapp_session_rtf", "Smoothed real-time factor of final decodes.", labels=("session",))
+SESSION_BYTES = Counter("transapp_session_received_bytes_total", "Audio bytes received per session.", labels=("session",))
+SESSION_SEGMENTS = Counter("transapp_session_segments_total", "Speech segments transcribed per session.", labels=("session",))
+SESSION_PARTIALS = Counter("transapp_session_partials_total", "Partial hypotheses sent per session.", labels=("session",))
+Gauge("transapp_inference_queue_depth", "Windows waiting for a batch.",
+      function=lambda: scheduler.queue.qsize() if scheduler else 0)
+Gauge("transapp_translation_queue_depth", "Texts waiting for a translation batch.",
+      function=lambda: translator.queue.qsize() if translator else 0)
+
+
+class StreamSession:
+    """One WebSocket session, run as a pipeline of async stages joined by bounded queues.
 
-        async for message in websocket:
+    ingest (socket) -> segment (VAD) -> infer (Whisper) -> translate -> emit (socket)
+
+    Each stage is a single task working through its queue in order, so output
+    order is preserved while translation of one segment overlaps inference of
+    the next and audio keeps being read while both run. A full queue makes the
+    stage before it wait, down to the socket.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.id = str(next(session_ids))
+        self.config = SessionConfig(language_recheck_s=LANGUAGE_RECHECK_S)
+        self.segmenter = SpeechSegmenter(VoiceActivityDetector(SAMPLE_RATE), SAMPLE_RATE,
+                                         max_segment_s=VAD_MAX_SEGMENT_S, min_silence_ms=VAD_MIN_SILENCE_MS)
+        self.hypothesis = HypothesisBuffer()
+        self.audio = asyncio.Queue(PIPELINE_QUEUE_SIZE)  # ingest -> segment: PCM chunks
+        # segment -> infer: audio windows. Bounded by audio time rather than count (the
+        # segment stage drops windows past MAX_LAG_S) so the socket is never left unread
+        # and the lag behind live audio stays measurable.
+        self.windows = asyncio.Queue()
+        self.backlog_samples = 0  # Audio in queued final windows
+        self.skipped = None  # (start, end) of audio dropped from the backlog, not yet reported
+        self.responses = asyncio.Queue(PIPELINE_QUEUE_SIZE)  # infer -> translate: responses
+        self.outgoing = asyncio.Queue(PIPELINE_QUEUE_SIZE)  # translate -> emit: translated responses
+        self.received_samples = 0  # Stream position, used to timestamp responses
+
+        # The open segment is shared by the segment stage (which fills it) and the
+        # infer stage (which commits its stable prefix); both track it by id and by
+        # the samples dropped from its start
+        self.segment_id = 0
+        self.discarded = 0  # Samples the segmenter has dropped from the open segment
+        self.committed = 0  # Samples of segment `committed_segment` already sent as final text
+        self.committed_segment = 0
+        self.partial_pending = False  # At most one partial decode is queued at a time
+        # Partials re-decode the open segment as it grows; its log-mel frames are cached so
+        # each decode only computes features for the audio that arrived since the last one
+        self.features = IncrementalLogMel(scheduler.backend.n_mels) if PARTIAL_SAMPLES else None
+        self.catching_up = False
+        self.rtf = None  # Smoothed decode time per second of audio
+
+    async def run(self):
+        stages = [asyncio.create_task(stage) for stage in
+                  (self.ingest(), self.segment(), self.infer(), self.translate(), self.emit())]
+        try:
+            done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in stages:
+                task.cancel()  # The client is gone or a stage failed; drop the rest
+        for task in done:
+            task.result()  # Re-raises a stage's exception
+
+    async def ingest(self):
+        """Reads the socket: an optional config message, then audio frames or bare PCM16 chunks."""
+        frames = None  # FrameReader once a codec is negotiated
+        async for message in self.websocket:
             if isinstance(message, bytes):  # Ensure we're handling binary audio data
-                print(f"Received binary audio chunk of size: {len(message)} bytes")
-                audio_buffer.extend(message)  # Add chunk to the buffer
-
-                # Check if we have enough data (5 seconds of audio)
-                if len(audio_buffer) >= 16000 * 2 * 5:  # Process every 5 seconds of 16-bit mono audio (WAV)
-                    print(f"Processing audio buffer of size: {len(audio_buffer)} bytes for transcription...")
-
-                    # Save the buffer to a temporary WAV file for transcription
-                    temp_filename = "temp_audio.wav"
-                    with wave.open(temp_filename, "wb") as f:
-                        f.setnchannels(1)  # Mono audio
-                        f.setsampwidth(2)  # 16-bit audio
-                        f.setframerate(16000)  # 16 kHz sample rate
-                        f.writeframes(audio_buffer)
-
-                    print("WAV file created. Running Whisper model for transcription...")
-
-                    # Use Whisper to transcribe the WAV audio buffer
-                    result = model.transcribe(temp_filename, language='de', task='translate')
-                    transcription = result['text']
-                    print(f"Transcription result: {transcription}")
-
-                    if not transcription.strip():
-                        print("Transcription is empty.")
-                        # Send a message back to the client indicating no speech was detected
-                        response = {"transcription": "No speech detected."}
-                        await websocket.send(json.dumps(response))
-                    else:
-                        # Translate the transcription using DeepL
-                        translation = translator.translate_text(transcription, target_lang="EN-GB")
-                        print(f"Translated text: {translation.text}")
+                log.debug("Received binary audio chunk of size: %d bytes", len(message))
+                SESSION_BYTES.inc(len(message), session=self.id)
+                if frames is None:
+                    samples = message
+                    self.received_samples += len(message) // 2
+                else:
+                    try:
+                        samples, timestamp, missing = frames.read(message)
+                    except ValueError as e:
+                        await self.websocket.send(json.dumps({"type": "error", "message": str(e)}))
+                        await self.websocket.close(code=1003, reason="Invalid audio frame")
+                        return
+                    if missing:
+                        # Frames lost between client and server; the client may resend or re-sync
+                        log.warning("Session %s lost %d frames before %.2fs", self.id, missing, timestamp / SAMPLE_RATE)
+                        LOST_FRAMES.inc(missing)
+                        await self.outgoing.put(({"type": "gap", "missing_frames": missing,
+                                                  "timestamp": timestamp / SAMPLE_RATE}, None))
+                    self.received_samples += len(samples)
+                await self.audio.put((samples, self.received_samples / SAMPLE_RATE))
+            elif not self.received_samples:
+                # Session config, only accepted before any audio
+                try:
+                    self.config = SessionConfig.from_message(message, language_recheck_s=LANGUAGE_RECHECK_S)
+                except ValueError as e:
+                    await self.websocket.send(json.dumps({"type": "error", "message": str(e)}))
+                    await self.websocket.close(code=1008, reason="Invalid config")
+                    return
+                log.info("Session %s config: %s", self.id, self.config.as_dict())
+                if self.config.codec:
+                    frames = FrameReader(self.config.codec)
+                await self.outgoing.put((self.config.as_dict(), None))
+            else:
+                log.warning("Received unexpected non-binary message: %s", message)
+
+    async def segment(self):
+        """Runs the VAD over incoming audio and queues closed segments and partial windows."""
+        loop = asyncio.get_running_loop()
+        opened_at = None  # When the open segment started filling
+        decoded_samples = 0  # Length of the open segment at its last partial decode
+        while True:
+            message, audio_end = await self.audio.get()
+
+            # Prefix the infer stage has committed since the last chunk leaves the rolling window
+            if self.committed_segment == self.segment_id and self.committed > self.discarded:
+                self.segmenter.discard(self.committed - self.discarded)
+                decoded_samples -= self.committed - self.discarded
+                self.discarded = self.committed
+
+            # Silence is dropped here; only closed speech segments reach the model
+            with timed("vad"):
+                closed = self.segmenter.push(message)
+            now = loop.time()
+
+            for audio in closed:
+                log.debug("Processing speech segment of %.2fs for transcription...", len(audio) / SAMPLE_RATE)
+                trace = tracer.start("segment", session=self.id, seconds=round(len(audio) / SAMPLE_RATE, 3))
+                observe_stage("buffer_fill", now - (opened_at or now), trace)
+                self.queue_window(("final", self.segment_id, self.discarded, audio, audio_end, trace))
+                self.segment_id += 1
+                self.discarded = 0
+                decoded_samples = 0
+
+            if not len(self.segmenter):
+                opened_at = None
+            elif opened_at is None or closed:
+                opened_at = now
 
-                        # Send the translated transcription back to the client
-                        response = {"transcription": translation.text}
-                        await websocket.send(json.dumps(response))
-                        print("Transcription sent to client")
+            if (PARTIAL_SAMPLES and not self.partial_pending and not self.catching_up
+                    and len(self.segmenter) - decoded_samples >= PARTIAL_SAMPLES):
+                trace = tracer.start("partial", session=self.id, audio_end=audio_end)
+                self.partial_pending = True
+                self.queue_window(("partial", self.segment_id, self.discarded, self.segmenter.peek(), audio_end, trace))
+                decoded_samples = len(self.segmenter)
 
-                    # Clear the buffer after processing
-                    audio_buffer.clear()
+    def queue_window(self, window):
+        """Queues a window for the infer stage, dropping the oldest ones past MAX_LAG_S of backlog.
 
-                    # Clean up the temporary file
-                    os.remove(temp_filename)
-                    print("Temporary WAV file removed")
+        Only finals count towards the backlog: a partial re-reads audio of the open
+        segment that its final will carry again. Over budget, a queued partial is
+        dropped first, then the oldest finals.
+        """
+        self.windows.put_nowait(window)
+        if window[0] != "final":
+            return
+        self.backlog_samples += len(window[3])
+        if self.backlog_samples <= MAX_LAG_S * SAMPLE_RATE:
+            return
+        pending = [self.windows.get_nowait() for _ in range(self.windows.qsize())]
+        finals = []
+        for queued in pending:
+            if queued[0] == "final":
+                finals.append(queued)
             else:
-                print(f"Received unexpected non-binary message: {message}")
+                self.drop_window(queued)
+        while self.backlog_samples > MAX_LAG_S * SAMPLE_RATE and len(finals) > 1:
+            self.drop_window(finals.pop(0))
+        for queued in finals:
+            self.windows.put_nowait(queued)
 
+    def drop_window(self, window):
+        kind, _, _, audio, audio_end, _ = window
+        if kind == "partial":
+            self.partial_pending = False
+            return
+        self.backlog_samples -= len(audio)
+        start = audio_end - len(audio) / SAMPLE_RATE
+        self.skipped = (self.skipped[0] if self.skipped else start, audio_end)
+        SKIPPED_SECONDS.inc(len(audio) / SAMPLE_RATE)
+
+    def take_window(self, window):
+        """Accounts for a window leaving the queue; returns its audio minus what partials already committed."""
+        kind, segment_id, offset, audio, _, _ = window
+        if kind == "final":
+            self.backlog_samples -= len(audio)
+        if segment_id != self.committed_segment:
+            self.committed_segment = segment_id
+            self.hypothesis.reset()
+            self.committed = 0
+            if self.features:
+                self.features.reset()
+        return audio[self.committed - offset:]  # Cut what a partial committed after the window was taken
+
+    async def infer(self):
+        """Transcribes windows in order and queues the responses for translation.
+
+        Each round takes every queued window. Behind real time, stale windows are
+        skipped, partial windows dropped and consecutive segments merged into as
+        few Whisper windows as possible, since a decode costs about the same for
+        5 s as for 30 s of audio.
+        """
+        while True:
+            windows = [await self.windows.get()]
+            while not self.windows.empty():
+                windows.append(self.windows.get_nowait())
+            live = self.received_samples / SAMPLE_RATE
+
+            await self.update_mode(live - windows[0][4])
+            merged = None  # [audio windows, audio_end, trace] of finals decoded together
+            for i, window in enumerate(windows):
+                kind, _, _, audio, audio_end, trace = window
+                if kind == "partial" and (self.catching_up or i < len(windows) - 1):
+                    self.drop_window(window)  # Stale: a newer window of the same audio follows
+                elif kind == "final" and live - audio_end > MAX_LAG_S:
+                    self.drop_window(window)
+                elif kind == "partial":
+                    await self.transcribe_partial(self.take_window(window), audio_end, trace, self.committed)
+                elif self.catching_up:
+                    audio = self.take_window(window)
+                    if merged and sum(map(len, merged[0])) + len(audio) <= MERGE_MAX_SAMPLES:
+                        merged[0].append(audio)
+                        merged[1] = audio_end
+                    else:
+                        if merged:
+                            await self.transcribe_final(np.concatenate(merged[0]), merged[1], merged[2])
+                        merged = [[audio], audio_end, trace]
+                else:
+                    await self.transcribe_final(self.take_window(window), audio_end, trace, self.committed)
+            if merged:
+                await self.transcribe_final(np.concatenate(merged[0]), merged[1], merged[2])
+
+            if self.skipped:
+                start, end = self.skipped
+                self.skipped = None
+                log.info("Session %s skipped %.1fs of audio behind real time", self.id, end - start)
+                await self.responses.put(({"type": "skipped", "audio_start": start, "audio_end": end}, None, False))
+
+    async def update_mode(self, lag):
+        """Enters or leaves catch-up mode from the lag of the oldest pending window, and tells the client."""
+        SESSION_LAG.set(round(lag, 3), session=self.id)
+        if self.catching_up == (lag > CATCHUP_LAG_S / 2 if self.catching_up else lag > CATCHUP_LAG_S):
+            return
+        self.catching_up = not self.catching_up
+        mode = "catchup" if self.catching_up else "live"
+        log.info("Session %s switches to %s mode, %.1fs behind, RTF %s", self.id, mode, lag, self.rtf)
+        await self.responses.put(({"type": "status", "mode": mode, "lag": round(lag, 3), "rtf": self.rtf},
+                                  None, False))
+
+    async def model_input(self, audio, start, model, trace):
+        """The window's log-mel features from the segment's cache, or its samples (Whisper computes the features).
+
+        The cache is only used by this session's infer stage, one window at a time, so
+        it is updated in a worker thread while the event loop serves other sessions.
+        """
+        if self.features is None or start is None or model.backend.n_mels != self.features.n_mels:
+            return audio  # No overlapping windows, a merged window, or a model with other mel bins
+        with timed("features", trace):
+            return await asyncio.to_thread(self.features.features, audio, start)
+
+    async def transcribe_final(self, audio, audio_end, trace, start=None):
+        """Transcribes a closed segment; `start` is its position in the segment, for the feature cache."""
+        language = await self.resolve_language(audio, audio_end)
+        # Hand the float32 samples straight to Whisper, no temp file or ffmpeg decode
+        model = catchup_scheduler if self.catching_up and catchup_scheduler else scheduler
+        started = time.perf_counter()
+        transcription = await model.transcribe(await self.model_input(audio, start, model, trace), language=language,
+                                               task=self.config.task, trace=trace)
+        rtf = (time.perf_counter() - started) / (len(audio) / SAMPLE_RATE)
+        self.rtf = round(rtf if self.rtf is None else 0.8 * self.rtf + 0.2 * rtf, 3)
+        SESSION_RTF.set(self.rtf, session=self.id)
+        log.debug("Transcription result: %s", transcription)
+        SESSION_SEGMENTS.inc(session=self.id)
+        if not transcription.strip():
+            log.debug("Transcription is empty.")
+            # With partials an empty final tells the client to drop the partial line
+            transcription = "" if PARTIAL_SAMPLES else "No speech detected."
+        await self.responses.put(({"type": "final", "transcription": transcription, "audio_end": audio_end},
+                                  trace, True))
+
+    async def transcribe_partial(self, audio, audio_end, trace, start=None):
+        language = await self.resolve_language(audio, audio_end)
+        # Re-decode the open segment, commit its stable prefix and send the rest as a partial
+        segments = await scheduler.transcribe(await self.model_input(audio, start, scheduler, trace), language=language,
+                                              task=self.config.task, timestamps=True, trace=trace)
+        self.partial_pending = False
+        committed, cut, partial = self.hypothesis.update(segments)
+        if committed:
+            # The segment stage drops it from the window; rounding keeps windows on the 10 ms mel hop.
+            # A hallucinated timestamp past the window must not cut audio that was never decoded.
+            cut_samples = min(round(cut * SAMPLE_RATE), len(audio))
+            self.committed += cut_samples
+            # The final ends at the cut: the rest of the window is still uncommitted
+            cut_end = audio_end - (len(audio) - cut_samples) / SAMPLE_RATE
+            await self.responses.put(({"type": "final", "transcription": " ".join(committed),
+                                       "audio_end": cut_end}, trace, False))
+        # Partials are the raw Whisper output; only final text goes through translation
+        await self.responses.put(({"type": "partial", "transcription": partial, "audio_end": audio_end}, trace, True))
+
+    async def resolve_language(self, audio, position):
+        """Returns the session's source language, detecting it first if it is "auto" and not known yet."""
+        config = self.config
+        if config.needs_detection(position):
+            with timed("language_detection"):
+                language, probability = await scheduler.detect_language(audio)
+            if language != config.detected:
+                log.info("Detected language %s (p=%.2f) at %.1fs", language, probability, position)
+                await self.responses.put(({"type": "language", "language": language, "probability": probability,
+                                           "audio_end": position}, None, False))
+            config.detected, config.detected_at = language, position
+        return config.source_language
+
+    async def translate(self):
+        """Translates final text in order; other responses pass straight through."""
+        while True:
+            response, trace, last = await self.responses.get()
+            text = response.get("transcription")
+            if response["type"] == "final" and text and self.config.target_lang:
+                # Translate the transcription (cached and batched across sessions)
+                source_lang = "EN" if self.config.task == "translate" else None  # Whisper already translated to English
+                try:
+                    with timed("translation", trace):
+                        response["transcription"] = await translator.translate(
+                            text, target_lang=self.config.target_lang, source_lang=source_lang)
+                    log.debug("Translated text: %s", response["transcription"])
+                except Exception as e:
+                    # A DeepL outage must not end the session; send the text untranslated and say so
+                    log.warning("Session %s sends untranslated text, translation failed: %s", self.id, e)
+                    response["translation_error"] = str(e) or type(e).__name__
+            await self.outgoing.put((response, trace if last else None))
+
+    async def emit(self):
+        """Sends responses to the client in the order they were produced."""
+        while True:
+            response, trace = await self.outgoing.get()
+            with timed("send", trace):
+                await self.websocket.send(json.dumps(response))
+            if response["type"] == "partial":
+                SESSION_PARTIALS.inc(session=self.id)
+            if trace is not None:
+                trace.finish()
+
+
+async def transcribe_audio(websocket, path):
+    """Handles WebSocket connection and streams audio data for transcription.
+
+    The client may open with a JSON config message (see SessionConfig); clients
+    that start sending audio straight away get the defaults.
+    """
+    session = StreamSession(websocket)
+    sessions.add(session)
+    try:
+        log.info("New WebSocket connection %s from %s", session.id, websocket.remote_address)
+        await session.run()
     except websockets.exceptions.ConnectionClosedError as e:
-        print(f"Connection closed: {e}")
+        log.info("Connection %s closed: %s", session.id, e)
     except Exception as e:
-        print(f"Error occurred: {e}")
+        log.exception("Error occurred: %s", e)
+    finally:
+        sessions.discard(session)
+        for counter in (SESSION_BYTES, SESSION_SEGMENTS, SESSION_PARTIALS, SESSION_LAG, SESSION_RTF):
+            counter.remove(session=session.id)
+
+
+async def serve_http(path, request_headers):
+    """Answers plain HTTP requests on the WebSocket port: /metrics, /load and /trace."""
+    url = urlparse(path)
+    if url.path == "/load":
+        # Polled by stream_gateway.py to place new sessions on the least-loaded worker
+        load = {"sessions": len(sessions),
+                "queue_depth": sum(session.windows.qsize() for session in sessions)
+                + (scheduler.queue.qsize() if scheduler else 0),
+                "max_sessions": MAX_SESSIONS}
+        return HTTPStatus.OK, [("Content-Type", "application/json")], json.dumps(load).encode()
+    if url.path == "/metrics":
+        return HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4")], REGISTRY.render().encode()
+    if url.path == "/trace":
+        rate = parse_qs(url.query).get("rate")
+        if rate:
+            if not bearer_matches(request_headers.get("Authorization"), TRACE_TOKEN):
+                return HTTPStatus.FORBIDDEN, [], b"changing the rate needs the TRACE_TOKEN bearer token"
+            try:
+                tracer.sample_rate = min(1.0, max(0.0, float(rate[0])))
+            except ValueError:
+                return HTTPStatus.BAD_REQUEST, [], b"rate must be a number between 0 and 1"
+            log.info("Trace sample rate set to %s", tracer.sample_rate)
+        return HTTPStatus.OK, [("Content-Type", "application/json")], json.dumps({"rate": tracer.sample_rate}).encode()
+    if MAX_SESSIONS and len(sessions) >= MAX_SESSIONS:
+        # Refuse the handshake cleanly rather than degrade every session
+        REJECTED_SESSIONS.inc()
+        log.warning("Refusing connection, %d sessions open", len(sessions))
+        return (HTTPStatus.SERVICE_UNAVAILABLE, [("Retry-After", str(SESSION_RETRY_AFTER_S))],
+                b"Too many sessions, retry later.\n")
+    return None  # Everything else is a WebSocket handshake
 
 
 # Start the WebSocket server
 async def main():
-    async with websockets.serve(transcribe_audio, "0.0.0.0", 42331):
-        print("WebSocket server started at port 42331...")
-        await asyncio.Future()  # Run forever
+    global scheduler, catchup_scheduler, translator
+    translator = Translator(create_backend(), cache_size=TRANSLATION_CACHE_SIZE, cache_ttl=TRANSLATION_CACHE_TTL_S)
+    tasks = [asyncio.create_task(translator.run())]
+
+    if INFERENCE_WORKERS > 0:
+        backend = ProcessPoolBackend(WHISPER_MODEL, workers=INFERENCE_WORKERS, torch_threads=TORCH_THREADS,
+                                     device=WHISPER_DEVICE, precision=WHISPER_PRECISION)
+    else:
+        backend = ThreadBackend(load_model(WHISPER_MODEL, WHISPER_DEVICE, WHISPER_PRECISION, TORCH_THREADS))
+    await backend.warm_up()
+    scheduler = InferenceScheduler(backend, max_batch_size=BATCH_SIZE, max_wait=BATCH_WAIT_MS / 1000)
+    tasks.append(asyncio.create_task(scheduler.run()))
+    if CATCHUP_MODEL:
+        # Smaller model for sessions that fall behind, kept in the server process
+        catchup_backend = ThreadBackend(load_model(CATCHUP_MODEL, WHISPER_DEVICE, WHISPER_PRECISION, TORCH_THREADS))
+        catchup_scheduler = InferenceScheduler(catchup_backend, max_batch_size=BATCH_SIZE, max_wait=BATCH_WAIT_MS / 1000)
+        tasks.append(asyncio.create_task(catchup_scheduler.run()))
+
+    async with websockets.serve(transcribe_audio, "0.0.0.0", PORT, process_request=serve_http):
+        log.info("WebSocket server started at port %d...", PORT)
+        await asyncio.gather(*tasks)  # Runs forever; ends the server if a background task fails
 
 # Run the WebSocket server
 if __name__ == "__main__":